@@ -0,0 +1,380 @@
+# ---------- offline benchmark
+# Поднимает в процессе заглушки Notion API, Telegram Bot API и OpenWeather и гоняет через них
+# горячие пути main.py. Наружу ничего не ходит; данные и задержки детерминированы --seed.
+#
+#   python bench.py                                   # все сценарии, по 10 с
+#   python bench.py -s exec,telegram -r 20 -d 30      # 20 оп/с, открытая модель нагрузки
+#   python bench.py -r 0 -c 8 --latency-ms 80 --throttle-every 20
+#
+# -r 0 — замкнутая модель: -c потоков без пауз. Латентность в открытой модели считается
+# от планового старта операции, чтобы очередь перед пулом не пряталась.
+import argparse, json, os, random, sys, tempfile, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Lock, Thread
+from urllib.parse import parse_qs, urlparse
+
+SCENARIOS = ("exec", "poll", "scheduled", "telegram")
+DBS = ("commands", "schedule", "templates", "log", "todo", "projects", "jobs", "inspo", "budget")
+TOKEN, CHAT = "1000:bench", 4242
+
+def iso(dt): return dt.astimezone(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+def rt(s): return [{"type": "text", "text": {"content": s}, "plain_text": s}]
+
+# ---------- fake Notion
+def _plain(prop):
+    if not prop: return None
+    for k in ("title", "rich_text"):
+        if k in prop: return "".join(r.get("text", {}).get("content", "") for r in prop[k] or [])
+    for k in ("select", "status"):
+        if k in prop: return (prop[k] or {}).get("name")
+    if "multi_select" in prop: return [o.get("name") for o in prop["multi_select"] or []]
+    if "date" in prop: return (prop["date"] or {}).get("start")
+    for k in ("checkbox", "number", "url"):
+        if k in prop: return prop[k]
+    return None
+
+def _cmp_time(a, b):
+    if len(a) == 10 or len(b) == 10: a, b = a[:10], b[:10]
+    else: a, b = (datetime.fromisoformat(x.replace("Z", "+00:00")) for x in (a, b))
+    return (a > b) - (a < b)
+
+def _check(val, cond):
+    for op, arg in cond.items():
+        if op == "is_empty": ok = val in (None, "", [])
+        elif op == "is_not_empty": ok = val not in (None, "", [])
+        elif val is None: ok = False
+        elif op == "equals": ok = val == arg
+        elif op == "does_not_equal": ok = val != arg
+        elif op == "contains": ok = (arg in val) if isinstance(val, list) else arg.lower() in str(val).lower()
+        elif op in ("before", "after", "on_or_before", "on_or_after"):
+            c = _cmp_time(val, arg)
+            ok = {"before": c < 0, "after": c > 0, "on_or_before": c <= 0, "on_or_after": c >= 0}[op]
+        elif op in ("greater_than", "less_than"): ok = val > arg if op == "greater_than" else val < arg
+        else: ok = True   # незнакомое условие не сужает выборку
+        if not ok: return False
+    return True
+
+def _match(page, f):
+    if not f: return True
+    if "and" in f: return all(_match(page, x) for x in f["and"])
+    if "or" in f: return any(_match(page, x) for x in f["or"])
+    if "timestamp" in f: return _check(page[f["timestamp"]], f[f["timestamp"]])
+    kind = next(k for k in f if k != "property")
+    return _check(_plain(page["properties"].get(f["property"])), f[kind])
+
+class FakeNotion:
+    def __init__(self, rng, latency, jitter, throttle_every):
+        self.rng, self.latency, self.jitter, self.throttle_every = rng, latency, jitter, throttle_every
+        self.dbs = {name: uuid.UUID(int=i + 1).hex for i, name in enumerate(DBS)}
+        self.pages = {}        # page_id -> page
+        self.rows = {db: [] for db in self.dbs.values()}
+        self.lock = Lock()
+        self.requests = self.throttled = 0
+
+    def add(self, db, props, edited=None):
+        now = edited or datetime.now(timezone.utc)
+        page = {"object": "page", "id": str(uuid.UUID(int=self.rng.getrandbits(128))), "created_time": iso(now),
+                "last_edited_time": iso(now), "archived": False, "in_trash": False,
+                "parent": {"type": "database_id", "database_id": self.dbs[db] if db in self.dbs else db},
+                "properties": {k: self._prop(v) for k, v in props.items()}}
+        with self.lock:
+            self.pages[page["id"]] = page; self.rows[page["parent"]["database_id"]].append(page)
+        return page
+
+    def _prop(self, v):
+        for k in ("title", "rich_text"):
+            if k in v: return {k: [{"type": "text", "text": {"content": r.get("text", {}).get("content", "")},
+                                    "plain_text": r.get("text", {}).get("content", "")} for r in v[k]]}
+        return dict(v)
+
+    def handle(self, method, path, body):
+        # -> (status, payload, headers)
+        with self.lock:
+            self.requests += 1
+            throttle = self.throttle_every and self.requests % self.throttle_every == 0
+            if throttle: self.throttled += 1
+        time.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if throttle:
+            return 429, {"object": "error", "status": 429, "code": "rate_limited", "message": "bench"}, {"Retry-After": "0.05"}
+        parts = path.strip("/").split("/")[1:]   # без "v1"
+        if parts[:2] == ["users", "me"]: return 200, {"object": "user", "id": "bench", "type": "bot"}, {}
+        if parts[0] == "databases" and parts[-1] == "query": return 200, self.query(parts[1], body), {}
+        if parts == ["pages"] and method == "POST":
+            db = body["parent"]["database_id"].replace("-", "")
+            if db not in self.rows: return self.missing()
+            return 200, self.add(db, body.get("properties", {})), {}
+        if parts[0] == "pages" and len(parts) == 2:
+            page = self.pages.get(parts[1]) or self.pages.get(str(uuid.UUID(parts[1])))
+            if not page: return self.missing()
+            if method == "PATCH":
+                with self.lock:
+                    page["properties"].update({k: self._prop(v) for k, v in body.get("properties", {}).items()})
+                    page["archived"] = body.get("archived", page["archived"])
+                    page["last_edited_time"] = iso(datetime.now(timezone.utc))
+            return 200, page, {}
+        if parts[0] == "blocks" and parts[-1] == "children":
+            return 200, {"object": "list", "results": body.get("children", []), "has_more": False, "next_cursor": None}, {}
+        return self.missing()
+
+    def missing(self): return 404, {"object": "error", "status": 404, "code": "object_not_found", "message": "bench"}, {}
+
+    def query(self, db, body):
+        db = db.replace("-", "")
+        with self.lock: rows = [p for p in self.rows.get(db, []) if not p["archived"] and _match(p, body.get("filter"))]
+        for s in reversed(body.get("sorts") or []):
+            key = s.get("timestamp")
+            rows.sort(key=(lambda p: p[key]) if key else (lambda p: str(_plain(p["properties"].get(s["property"])) or "")),
+                      reverse=s.get("direction") == "descending")
+        start, size = int(body.get("start_cursor") or 0), min(int(body.get("page_size") or 100), 100)
+        more = start + size < len(rows)
+        return {"object": "list", "results": rows[start:start + size], "has_more": more,
+                "next_cursor": str(start + size) if more else None}
+
+# ---------- fake Telegram Bot API
+class FakeTelegram:
+    def __init__(self, latency):
+        self.latency = latency
+        self.cond = Condition()
+        self.updates, self.next_update = [], 1
+        self.sent = 0
+        self.replies = {}      # message_id входящей команды -> время первого ответа
+        self.message_id = 10 ** 6
+
+    def push_command(self, text):
+        with self.cond:
+            uid = self.next_update; self.next_update += 1
+            user = {"id": CHAT, "is_bot": False, "first_name": "Bench"}
+            # группа, а не личка: reply_text тогда проставляет reply_to_message_id, по нему и сводим ответы
+            self.updates.append({"update_id": uid, "message": {
+                "message_id": uid, "date": int(time.time()), "text": text, "from": user,
+                "chat": {"id": CHAT, "type": "group", "title": "bench"},
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}})
+            self.cond.notify_all()
+        return uid
+
+    def handle(self, method, body):
+        if method == "getUpdates":
+            offset, timeout = int(body.get("offset") or 0), float(body.get("timeout") or 0)
+            with self.cond:
+                self.updates = [u for u in self.updates if u["update_id"] >= offset]
+                if not self.updates: self.cond.wait(timeout=min(timeout, 1.0))
+                return 200, {"ok": True, "result": list(self.updates[:int(body.get("limit") or 100)])}
+        time.sleep(self.latency)
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1000, "is_bot": True, "first_name": "Connor", "username": "connor_bench_bot"}}
+        if method == "sendMessage":
+            with self.cond:
+                self.sent += 1; self.message_id += 1; mid = self.message_id
+                reply_to = body.get("reply_to_message_id")
+                if reply_to and int(reply_to) not in self.replies: self.replies[int(reply_to)] = time.perf_counter()
+            return 200, {"ok": True, "result": {"message_id": mid, "date": int(time.time()), "text": body.get("text", ""),
+                                                "chat": {"id": int(body.get("chat_id", CHAT)), "type": "private"}}}
+        return 200, {"ok": True, "result": True}
+
+    def reply_time(self, uid):
+        with self.cond: return self.replies.get(uid)
+
+# ---------- один HTTP-сервер на все три заглушки
+def serve(notion_api, telegram_api, weather_latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+        def _body(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if not raw: return {}
+            if "json" in (self.headers.get("Content-Type") or ""): return json.loads(raw)
+            return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+        def _reply(self, status, payload, headers=None):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items(): self.send_header(k, v)
+            self.end_headers(); self.wfile.write(data)
+        def _route(self):
+            url, body = urlparse(self.path), self._body()
+            if url.path.startswith("/notion/"):
+                return self._reply(*notion_api.handle(self.command, url.path[len("/notion"):], body))
+            if url.path.startswith("/tg/bot"):
+                return self._reply(*telegram_api.handle(url.path.rsplit("/", 1)[-1], body))
+            if url.path == "/weather":
+                time.sleep(weather_latency)
+                city = parse_qs(url.query).get("q", ["Seoul"])[0]
+                return self._reply(200, {"name": city, "weather": [{"description": "ясно"}], "main": {"temp": 21.5, "feels_like": 20.9}})
+            self._reply(404, {"error": "unknown path"})
+        do_GET = do_POST = do_PATCH = do_DELETE = _route
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    Thread(target=srv.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{srv.server_address[1]}"
+
+# ---------- данные
+COMMAND_MIX = ("todo_add", "todo_list", "job_list", "inspo_list", "budget_add_expense", "send", "list_schedule")
+
+def command_props(rng, cmd):
+    props = {"Title": {"title": rt(cmd)}, "Command": {"select": {"name": cmd}}, "Status": {"select": {"name": "Pending"}}}
+    if cmd in ("todo_add", "job_add"): props["Name"] = {"rich_text": rt(f"bench item {rng.randrange(10 ** 6)}")}
+    if cmd == "send": props["Text"] = {"rich_text": rt("бенчмарк")}
+    if cmd == "budget_add_expense":
+        props["Amount"] = {"number": rng.randrange(1, 500) * 100}; props["Category2"] = {"rich_text": rt("еда")}
+    return props
+
+def seed(api, rng, rows, now):
+    for i in range(rows):
+        api.add("todo", {"Title": {"title": rt(f"задача {i}")}, "Status": {"select": {"name": rng.choice(["Todo", "Done"])}},
+                         "Due": {"date": {"start": f"{now:%Y-%m}-{rng.randint(1, 28):02d}"}}})
+        api.add("jobs", {"Role": {"title": rt(f"роль {i}")}, "Company": {"rich_text": rt(f"компания {i % 37}")},
+                         "Stage": {"select": {"name": rng.choice(["Applied", "Interview", "Offer"])}}})
+        api.add("inspo", {"Title": {"title": rt(f"идея {i}")}, "Text": {"rich_text": rt("текст " * 10)}})
+        api.add("budget", {"Title": {"title": rt(f"expense {i}")}, "Type": {"select": {"name": rng.choice(["income", "expense"])}},
+                           "Amount": {"number": rng.randrange(1, 1000) * 10}, "Category": {"rich_text": rt(rng.choice(["еда", "дом", "транспорт"]))},
+                           "Date": {"date": {"start": f"{now:%Y-%m}-{rng.randint(1, 28):02d}"}}})
+    for cat in ("morning", "evening", "day", "pulse"):
+        for i in range(20): api.add("templates", {"Title": {"title": rt(f"{cat} {i}")}, "Category": {"rich_text": rt(cat)},
+                                                  "Text": {"rich_text": rt(f"{cat} шаблон {i}")}})
+    # расписание: все строки на ближайшие минуты, чтобы каждый тик что-то отправлял
+    days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+    for i in range(rows):
+        t = now + timedelta(minutes=i % 60)
+        kind = rng.choice(["morning", "evening", "day", "custom"])
+        props = {"Title": {"title": rt(f"слот {i}")}, "Type": {"select": {"name": kind}}, "Time": {"rich_text": rt(f"{t:%H:%M}")},
+                 "Days": {"multi_select": [{"name": d} for d in days]}, "Enabled": {"checkbox": True}}
+        if kind == "custom": props["Text"] = {"rich_text": rt(f"напоминание {i}")}
+        else: props["TemplateCategory"] = {"rich_text": rt(kind)}
+        api.add("schedule", props)
+
+# ---------- нагрузка и отчёт
+def pct(xs, p):
+    if not xs: return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, max(0, int(round(p / 100 * len(xs) + 0.5)) - 1))]
+
+def drive(op, rate, duration, concurrency):
+    # op() -> секунды латентности (None — измерить время вызова); исключение — ошибка
+    lat, errors, lock = [], [0], Lock()
+    def one(planned):
+        try:
+            t = op()
+            with lock: lat.append(t if t is not None else time.perf_counter() - planned)
+        except Exception as e:
+            with lock: errors[0] += 1
+            if errors[0] <= 3: print("  op error:", e)
+    t0 = time.perf_counter()
+    if rate:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            i = 0
+            while i / rate < duration:
+                planned = t0 + i / rate
+                time.sleep(max(0.0, planned - time.perf_counter()))
+                pool.submit(one, planned); i += 1
+    else:
+        def loop():
+            while time.perf_counter() - t0 < duration: one(time.perf_counter())
+        threads = [Thread(target=loop) for _ in range(concurrency)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    wall = time.perf_counter() - t0
+    return {"n": len(lat), "errors": errors[0], "ops_per_sec": len(lat) / wall if wall else 0.0,
+            "p50_ms": pct(lat, 50) * 1000, "p90_ms": pct(lat, 90) * 1000, "p99_ms": pct(lat, 99) * 1000,
+            "max_ms": max(lat, default=0) * 1000}
+
+def main_(argv=None):
+    ap = argparse.ArgumentParser(description="offline benchmark for main.py")
+    ap.add_argument("-s", "--scenarios", default=",".join(SCENARIOS), help="через запятую: " + ", ".join(SCENARIOS))
+    ap.add_argument("-r", "--rate", type=float, default=0, help="операций в секунду на сценарий (0 — без пауз)")
+    ap.add_argument("-d", "--duration", type=float, default=10, help="секунд на сценарий")
+    ap.add_argument("-c", "--concurrency", type=int, default=4)
+    ap.add_argument("--rows", type=int, default=250, help="строк в каждой базе")
+    ap.add_argument("--batch", type=int, default=10, help="команд на один poll_notion_commands")
+    ap.add_argument("--latency-ms", type=float, default=30, help="задержка ответа Notion")
+    ap.add_argument("--jitter-ms", type=float, default=10)
+    ap.add_argument("--throttle-every", type=int, default=0, help="каждый N-й запрос к Notion получает 429")
+    ap.add_argument("--tg-latency-ms", type=float, default=15)
+    ap.add_argument("--weather-latency-ms", type=float, default=50)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default="bench_output.txt", help="куда дописать отчёт (пусто — только stdout)")
+    args = ap.parse_args(argv)
+    chosen = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(chosen) - set(SCENARIOS)
+    if unknown: ap.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    rng = random.Random(args.seed); random.seed(args.seed)
+    notion_api = FakeNotion(rng, args.latency_ms / 1000, args.jitter_ms / 1000, args.throttle_every)
+    telegram_api = FakeTelegram(args.tg_latency_ms / 1000)
+    base = serve(notion_api, telegram_api, args.weather_latency_ms / 1000)
+
+    # main.py читает окружение при импорте: всё локальное и во временном каталоге
+    tmp = tempfile.mkdtemp(prefix="connor-bench-")
+    os.environ.update({
+        "API_TOKEN": TOKEN, "CHAT_ID": str(CHAT), "WEATHER_API_KEY": "bench", "WEATHER_URL": f"{base}/weather",
+        "NOTION_TOKEN": "secret_bench", "NOTION_API_URL": f"{base}/notion", "TELEGRAM_API_URL": f"{base}/tg/bot",
+        "OUTBOX_PATH": os.path.join(tmp, "outbox.sqlite3"), "LEDGER_PATH": os.path.join(tmp, "ledger.sqlite3"),
+        "SNAPSHOT_PATH": os.path.join(tmp, "state_snapshot.json"), "LOG_SPILL_PATH": os.path.join(tmp, "spill.jsonl"),
+        "SUBSCRIBERS_PATH": os.path.join(tmp, "subscribers.sqlite3"),
+        "TG_CHAT_INTERVAL_SEC": "0", "TG_GLOBAL_RPS": "1000", "NOTION_RPS": "1000", "NOTION_BURST": "1000",
+    })
+    os.environ.update({f"NOTION_{db.upper()}_DB": notion_api.dbs[db] for db in DBS})
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+
+    now = datetime.now(main.seoul_tz).replace(second=0, microsecond=0)
+    t = time.perf_counter(); seed(notion_api, rng, args.rows, now)
+    print(f"seeded {args.rows} rows/db in {time.perf_counter() - t:.1f}s; notion {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms"
+          f"{f', 429 every {args.throttle_every}' if args.throttle_every else ''}")
+    main.load_subscribers()   # как в __main__: без владельца в реестре /weather и др. ответят «Сначала /start.»
+    main.start_sender()
+
+    def op_exec():
+        pg = notion_api.add("commands", command_props(rng, rng.choice(COMMAND_MIX)))
+        main.exec_command(pg)
+
+    def op_poll():
+        for _ in range(args.batch): notion_api.add("commands", command_props(rng, rng.choice(COMMAND_MIX)))
+        main.poll_notion_commands()
+
+    main.reload_schedule(force=True, full=True)
+    ticks = [now + timedelta(minutes=i) for i in range(60)]
+    def op_scheduled():
+        main.run_scheduled_from_notion(rng.choice(ticks))
+
+    commands = ("/status", "/todo_list", "/job_list", "/weather", "/send бенчмарк")
+    def op_telegram():
+        t0 = time.perf_counter()
+        uid = telegram_api.push_command(rng.choice(commands))
+        while time.perf_counter() - t0 < 30:
+            done = telegram_api.reply_time(uid)
+            if done: return done - t0
+            time.sleep(0.002)
+        raise TimeoutError(f"no reply to update {uid}")
+
+    ops = {"exec": op_exec, "poll": op_poll, "scheduled": op_scheduled, "telegram": op_telegram}
+    if "telegram" in chosen:
+        Thread(target=main.run_telegram_bot, daemon=True).start(); time.sleep(0.5)   # настоящий polling против заглушки
+    results = {}
+    for name in chosen:
+        before = notion_api.requests
+        print(f"-> {name}: {'rate ' + str(args.rate) + '/s' if args.rate else 'closed loop'}, c={args.concurrency}, {args.duration:.0f}s")
+        res = drive(ops[name], args.rate, args.duration, args.concurrency)
+        res["notion_requests"] = notion_api.requests - before
+        if name == "poll": res["commands_per_sec"] = res["ops_per_sec"] * args.batch
+        results[name] = res
+
+    lines = [f"# bench {datetime.now():%Y-%m-%d %H:%M:%S} seed={args.seed} rate={args.rate} c={args.concurrency} "
+             f"rows={args.rows} notion={args.latency_ms:.0f}ms throttle_every={args.throttle_every}",
+             f"{'scenario':<10} {'n':>6} {'err':>4} {'ops/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'notion':>7}"]
+    for name, r in results.items():
+        lines.append(f"{name:<10} {r['n']:>6} {r['errors']:>4} {r['ops_per_sec']:>8.1f} {r['p50_ms']:>8.1f} {r['p90_ms']:>8.1f} "
+                     f"{r['p99_ms']:>8.1f} {r['max_ms']:>8.1f} {r['notion_requests']:>7}")
+    retries = sum(v["retries"] for v in main.notion.stats_snapshot().values())
+    lines.append(f"notion: {notion_api.requests} requests, {notion_api.throttled} throttled, {retries} client retries; "
+                 f"telegram: {telegram_api.sent} messages sent")
+    report = "\n".join(lines)
+    print(report)
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f: f.write(report + "\n\n")
+    return results
+
+if __name__ == "__main__":
+    main_()
@@ -1,12 +1,17 @@
 # Main.py — Connor + Notion + Telegram commands
-from telegram import Bot
-from telegram.ext import Updater, CommandHandler
+import time; BOOT_T0 = time.perf_counter()   # отсчёт для отчёта о старте
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.utils.request import Request
+from telegram.error import RetryAfter, BadRequest, Unauthorized, ChatMigrated
 from functools import wraps
-from flask import Flask
-from threading import Thread
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from threading import Thread, Lock, Condition, Event, current_thread
 from notion_client import Client as Notion
-from datetime import datetime, date
-import requests, pytz, random, os, time
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+from datetime import datetime, date, timedelta
+import requests, httpx, pytz, random, os, json, queue, atexit, signal, sys, heapq, re, hmac, difflib, sqlite3, uuid, socket
 
 # ---------- TZ
 seoul_tz = pytz.timezone("Asia/Seoul")
@@ -18,12 +23,22 @@ def env(name, default=None, required=False):
         raise RuntimeError(f"Missing env var: {name}")
     return v
 
+REQUIRED_ENV = ("API_TOKEN", "CHAT_ID")
+_missing = [n for n in REQUIRED_ENV if not os.getenv(n)]
+if _missing: raise RuntimeError(f"Missing env vars: {', '.join(_missing)}")   # все сразу, а не по одной за перезапуск
 API_TOKEN = env("API_TOKEN", required=True)
 CHAT_ID = int(env("CHAT_ID", required=True))
 WEATHER_API_KEY = env("WEATHER_API_KEY", None)
 CITY_NAME = env("CITY_NAME", "Seoul")
+# состояние, которое должно пережить деплой (outbox, журнал срабатываний, снимок, получатели); на Render — подключённый disk
+DATA_DIR = env("DATA_DIR", "")
+if DATA_DIR: os.makedirs(DATA_DIR, exist_ok=True)
+
+def data_path(name): return os.path.join(DATA_DIR, name)
 
 NOTION_TOKEN = env("NOTION_TOKEN", None)
+NOTION_API_URL = env("NOTION_API_URL", "https://api.notion.com")        # подменяется в bench.py
+TELEGRAM_API_URL = env("TELEGRAM_API_URL", "https://api.telegram.org/bot")
 NOTION_COMMANDS_DB = env("NOTION_COMMANDS_DB", None)
 NOTION_SCHEDULE_DB = env("NOTION_SCHEDULE_DB", None)
 NOTION_TEMPLATES_DB = env("NOTION_TEMPLATES_DB", None)
@@ -38,20 +53,336 @@ NOTION_JOBS_DB = env("NOTION_JOBS_DB", None)
 NOTION_INSPO_DB = env("NOTION_INSPO_DB", None)
 NOTION_HABITS_DB = env("NOTION_HABITS_DB", None)
 
+# ---------- Notion client (shared rate limit, retries, metrics)
+NOTION_RPS = float(env("NOTION_RPS", "3"))
+NOTION_BURST = int(env("NOTION_BURST", "3"))
+NOTION_MAX_RETRIES = int(env("NOTION_MAX_RETRIES", "3"))
+NOTION_TIMEOUT_MS = int(env("NOTION_TIMEOUT_MS", "20000"))
+NOTION_POOL_SIZE = int(env("NOTION_POOL_SIZE", "10"))
+RETRYABLE_STATUS = {409, 429, 500, 502, 503, 504}
+
+def _retry_after(ex):
+    try: return float(ex.headers.get("retry-after"))
+    except Exception: return None
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.ts = float(burst), time.monotonic()
+        self.paused_until = 0.0
+        self.lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, sec):
+        # после 429 ждут все потоки, а не только получивший ответ
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + sec)
+
+class NotionClient(Notion):
+    # один клиент на все потоки: общий token bucket, повторы с учётом Retry-After, счётчики по эндпоинтам
+    def __init__(self, auth):
+        http = httpx.Client(limits=httpx.Limits(
+            max_connections=NOTION_POOL_SIZE, max_keepalive_connections=NOTION_POOL_SIZE, keepalive_expiry=120))
+        super().__init__(client=http, auth=auth, timeout_ms=NOTION_TIMEOUT_MS, base_url=NOTION_API_URL)
+        self.bucket = TokenBucket(NOTION_RPS, NOTION_BURST)
+        self.stats = {}
+        self._stats_lock = Lock()
+
+    def request(self, path, method, query=None, body=None, auth=None):
+        endpoint = f"{method.upper()} {re.sub(r'[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}', '{id}', path)}"
+        # повторяем то, что безопасно повторить: 429 всегда, 5xx/таймауты — кроме создания страниц
+        # и добавления блоков (PATCH .../children: повтор после применённого запроса задвоит блоки)
+        idempotent = (method.upper() != "POST" or path.endswith("/query")) and not (method.upper() == "PATCH" and path.endswith("/children"))
+        delay = 1.0
+        for attempt in range(NOTION_MAX_RETRIES + 1):
+            self.bucket.acquire()
+            t0 = time.perf_counter()
+            try:
+                resp = super().request(path, method, query, body, auth)
+                self._record(endpoint, t0, None, attempt)
+                return resp
+            except HTTPResponseError as e:
+                self._record(endpoint, t0, e.status, attempt)
+                retry = e.status == 429 or (idempotent and e.status in RETRYABLE_STATUS)
+                if not retry or attempt == NOTION_MAX_RETRIES: raise
+                wait = _retry_after(e) or delay
+                if e.status == 429: self.bucket.pause(wait)
+            except (RequestTimeoutError, httpx.TransportError) as e:
+                self._record(endpoint, t0, type(e).__name__, attempt)
+                if not idempotent or attempt == NOTION_MAX_RETRIES: raise
+                wait = delay
+            time.sleep(min(wait, 60)); delay *= 2
+
+    def _record(self, endpoint, t0, error, attempt):
+        ms = (time.perf_counter() - t0) * 1000
+        with self._stats_lock:
+            st = self.stats.setdefault(endpoint, {"calls": 0, "errors": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0, "last_error": None})
+            st["calls"] += 1; st["total_ms"] += ms; st["max_ms"] = max(st["max_ms"], ms)
+            if attempt: st["retries"] += 1
+            if error is not None: st["errors"] += 1; st["last_error"] = str(error)
+
+    def stats_snapshot(self):
+        with self._stats_lock:
+            return {k: {**v, "total_ms": round(v["total_ms"], 1), "max_ms": round(v["max_ms"], 1),
+                        "avg_ms": round(v["total_ms"] / v["calls"], 1)} for k, v in self.stats.items()}
+
+# ---------- startup (lazy clients, boot timing, env/schema validation)
+BOOT = {}   # фаза -> секунд от BOOT_T0
+STARTUP_PROBLEMS = []
+
+def boot_mark(phase):
+    if phase in BOOT: return
+    BOOT[phase] = round(time.perf_counter() - BOOT_T0, 3)
+    if phase == "first_tick": print("startup:", ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in BOOT.items()))
+
+class LazyClient:
+    # клиент строится при первом обращении к атрибуту; bool() — настроен ли он, без построения
+    def __init__(self, factory, enabled=True):
+        self._factory, self._enabled, self._obj, self._lock = factory, enabled, None, Lock()
+
+    def get(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None: self._obj = self._factory()
+        return self._obj
+
+    def __getattr__(self, name): return getattr(self.get(), name)
+    def __bool__(self): return self._enabled
+
+NOTION_SCHEMAS = {   # база -> свойства, которые код читает и пишет
+    "NOTION_COMMANDS_DB": {"Command": "select", "Status": "select", "Text": "rich_text", "Result": "rich_text"},
+    "NOTION_SCHEDULE_DB": {"Type": "select", "Time": "rich_text", "Days": "multi_select", "Enabled": "checkbox", "Text": "rich_text"},
+    "NOTION_TEMPLATES_DB": {"Category": "rich_text", "Text": "rich_text"},
+    "NOTION_LOG_DB": {"Title": "title", "When": "date", "Type": "rich_text", "Text": "rich_text", "Result": "rich_text"},
+    "NOTION_TODO_DB": {"Title": "title", "Status": "select", "Due": "date", "Priority": "select"},
+    "NOTION_PROJECTS_DB": {"Name": "title", "Status": "select", "Due": "date"},
+    "NOTION_WEBSITE_DB": {"Title": "title"},
+    "NOTION_BUDGET_DB": {"Title": "title", "Type": "select", "Amount": "number", "Category": "rich_text", "Date": "date"},
+    "NOTION_JOBS_DB": {"Role": "title", "Company": "rich_text", "Stage": "select"},
+    "NOTION_INSPO_DB": {"Title": "title", "URL": "url"},
+    "NOTION_HABITS_DB": {"Habit": "title", "Date": "date", "Done": "checkbox"},
+}
+
+def _check_schema(name, db_id):
+    try: props = notion.databases.retrieve(database_id=db_id).get("properties", {})
+    except Exception as e: return [f"{name}: {e}"]
+    out = []
+    for prop, kind in NOTION_SCHEMAS[name].items():
+        have = (props.get(prop) or {}).get("type")
+        if have != kind: out.append(f"{name}: {prop} should be {kind}, {'got ' + have if have else 'missing'}")
+    return out
+
+def validate_startup():
+    # один проход, базы — параллельно; проблемы печатаются и видны в /readyz, но запуск не останавливают
+    problems = []
+    dbs = {n: os.getenv(n) for n in NOTION_SCHEMAS if os.getenv(n)}
+    if dbs and not NOTION_TOKEN: problems.append("NOTION_TOKEN not set: Notion databases are ignored"); dbs = {}
+    if not WEATHER_API_KEY: problems.append("WEATHER_API_KEY not set: weather is disabled")
+    if os.getenv("RENDER") and not DATA_DIR:
+        problems.append("DATA_DIR not set: outbox, ledger, snapshot and subscribers are lost on every deploy")
+    if dbs:
+        with ThreadPoolExecutor(max_workers=min(len(dbs), NOTION_POOL_SIZE), thread_name_prefix="validate") as pool:
+            for res in pool.map(lambda n: _check_schema(n, dbs[n]), dbs): problems.extend(res)
+    for pr in problems: print("startup check:", pr)
+    STARTUP_PROBLEMS[:] = problems
+    boot_mark("validated")
+    return problems
+
 # ---------- clients & state
-bot = Bot(token=API_TOKEN)
-notion = Notion(auth=NOTION_TOKEN) if NOTION_TOKEN else None
+TG_WORKERS = int(env("TG_WORKERS", "8"))
+# один пул соединений на всё: handlers (run_async), планировщик, HTTP-сервер
+bot = LazyClient(lambda: Bot(token=API_TOKEN, base_url=TELEGRAM_API_URL, request=Request(con_pool_size=TG_WORKERS + 4)))
+notion = LazyClient(lambda: NotionClient(auth=NOTION_TOKEN), enabled=bool(NOTION_TOKEN))
 
 PAUSED = False
 current_city = CITY_NAME
-last_minute = -1
 
 SCHEDULE_CACHE = []
+SCHEDULE_INDEX = {}    # (weekday, minute_of_day) -> [entries]
+SCHEDULE_ERRORS = []
+SCHEDULE_ROWS = {}     # page id -> row (включённые, не в архиве)
 SCHEDULE_CACHE_TS = 0
-SCHEDULE_REFRESH_SEC = 300
+SCHEDULE_REFRESH_SEC = int(env("SCHEDULE_REFRESH_SEC", "60"))
+SCHEDULE_FULL_RESYNC_SEC = int(env("SCHEDULE_FULL_RESYNC_SEC", "21600"))
+SCHEDULE_FULL_SYNC_TS = 0
+SCHEDULE_SYNCED_AT = None   # ISO (UTC): с какого last_edited_time спрашивать изменения
 
 MY_CHAT_ID = str(CHAT_ID)
 
+# ---------- metrics (Prometheus text format)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_HELP = {
+    "connor_call_seconds": ("histogram", "Latency of instrumented hot paths."),
+    "connor_calls_failed_total": ("counter", "Instrumented calls that raised."),
+    "connor_errors_total": ("counter", "Errors caught and handled, by place."),
+    "connor_commands_total": ("counter", "Notion commands executed, by command and status."),
+    "connor_scheduler_lag_seconds": ("histogram", "Actual minus planned fire time."),
+    "connor_scheduler_missed_total": ("counter", "Fires dropped after MISFIRE_GRACE_SEC."),
+}
+_metrics_lock = Lock()
+_counters = {}     # (name, labels) -> value
+_histograms = {}   # (name, labels) -> [счётчики по бакетам..., sum, count]
+
+def inc(name, value=1, **labels):
+    k = (name, tuple(sorted(labels.items())))
+    with _metrics_lock: _counters[k] = _counters.get(k, 0) + value
+
+def observe(name, value, **labels):
+    k = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        h = _histograms.get(k)
+        if h is None: h = _histograms[k] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+        for i, b in enumerate(LATENCY_BUCKETS):
+            if value <= b: h[i] += 1
+        h[-2] += value; h[-1] += 1
+
+def report_error(where, e=None):
+    inc("connor_errors_total", where=where)
+    if e is not None: print(f"{where} error:", e)
+
+def timed(name):
+    def deco(func):
+        @wraps(func)
+        def wrapper(*a, **k):
+            t0 = time.perf_counter()
+            try: return func(*a, **k)
+            except Exception:
+                inc("connor_calls_failed_total", fn=name); raise
+            finally: observe("connor_call_seconds", time.perf_counter() - t0, fn=name)
+        return wrapper
+    return deco
+
+def _labels(pairs):
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+def render_metrics(gauges=()):
+    # gauges: [(name, help, [(labels, value), ...])] — снимаются в момент запроса
+    with _metrics_lock:
+        counters, hists = dict(_counters), {k: list(v) for k, v in _histograms.items()}
+    out, seen = [], set()
+    def head(name, kind, text):
+        if name not in seen:
+            seen.add(name); out.extend([f"# HELP {name} {text}", f"# TYPE {name} {kind}"])
+    for (name, labels), v in sorted(counters.items()):
+        head(name, *METRIC_HELP.get(name, ("counter", name)))
+        out.append(f"{name}{_labels(labels)} {v}")
+    for (name, labels), h in sorted(hists.items()):
+        head(name, *METRIC_HELP.get(name, ("histogram", name)))
+        for b, c in zip(LATENCY_BUCKETS, h):
+            out.append(f"{name}_bucket{_labels(labels + (('le', b),))} {c}")
+        out.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {h[-1]}")
+        out.append(f"{name}_sum{_labels(labels)} {h[-2]:.6f}")
+        out.append(f"{name}_count{_labels(labels)} {h[-1]}")
+    for name, text, samples in gauges:
+        head(name, "counter" if name.endswith("_total") else "gauge", text)
+        for labels, v in samples: out.append(f"{name}{_labels(labels)} {v}")
+    return "\n".join(out) + "\n"
+
+# ---------- health (heartbeats, supervisor, dependency probes)
+SUPERVISE_SEC = int(env("SUPERVISE_SEC", "10"))
+PROBE_TTL_SEC = int(env("PROBE_TTL_SEC", "60"))
+SCHEDULE_READY_MAX_SEC = int(env("SCHEDULE_READY_MAX_SEC", "900"))
+HEARTBEATS = {}   # имя цикла -> time.time() последнего круга
+WORKERS = {}      # имя -> {target, stale, exclusive, retire, thread, restarts, started}; stale=None — только проверка is_alive
+PROBES = {}       # "telegram"/"notion" -> {ok, ts, ms, error}
+_health_lock = Lock()
+
+class WorkerRetired(Exception):
+    pass   # супервизор уже запустил замену зависшему потоку или ждёт, пока этот выйдет
+
+def beat(name):
+    w = WORKERS.get(name)
+    if w and w["thread"] is not None and (w["retire"] or w["thread"] is not current_thread()): raise WorkerRetired(name)
+    HEARTBEATS[name] = time.time()
+
+def _worker_main(name, target):
+    try: target()
+    except WorkerRetired: print(f"{name}: replaced by supervisor, exiting")
+    except Exception as e: report_error(f"worker {name}", e)
+
+def _spawn(name):
+    w = WORKERS[name]
+    w["retire"] = None
+    w["thread"] = Thread(target=_worker_main, args=(name, w["target"]), name=name, daemon=True)
+    w["started"] = HEARTBEATS[name] = time.time()
+    w["thread"].start()
+
+def start_worker(name, target, stale=None, exclusive=False):
+    # exclusive — двум экземплярам нельзя работать одновременно (getUpdates на один токен): замена только после выхода старого
+    with _health_lock:
+        WORKERS[name] = {"target": target, "stale": stale, "exclusive": exclusive, "retire": None,
+                         "thread": None, "restarts": 0, "started": 0.0}
+        _spawn(name)
+
+def worker_state(name, now=None):
+    w = WORKERS[name]
+    if not w["thread"].is_alive(): return "dead"
+    if w["stale"] and (now or time.time()) - HEARTBEATS.get(name, w["started"]) > w["stale"]: return "stuck"
+    return "ok"
+
+def supervise():
+    # главный поток: поднимает упавшие циклы; зависшему даём замену, старый выйдет на следующем beat().
+    # exclusive: зависшего только просим выйти, замену запускаем, когда поток действительно завершился
+    while True:
+        beat("supervisor")
+        with _health_lock:
+            for name, w in WORKERS.items():
+                state = worker_state(name)
+                if state == "ok": continue
+                if state == "stuck" and w["exclusive"]:
+                    if not w["retire"]: print(f"supervisor: {name} is stuck, waiting for it to exit"); w["retire"] = state
+                    continue
+                reason = w["retire"] or state
+                print(f"supervisor: {name} is {reason}, restarting")
+                inc("connor_worker_restarts_total", worker=name, reason=reason)
+                w["restarts"] += 1
+                _spawn(name)
+        start_sender()
+        time.sleep(SUPERVISE_SEC)
+
+def _probe(name, fn):
+    t0 = time.perf_counter()
+    try: fn(); ok, err = True, None
+    except Exception as e: ok, err = False, str(e)
+    PROBES[name] = {"ok": ok, "ts": time.time(), "ms": round((time.perf_counter() - t0) * 1000, 1), "error": err}
+
+def run_probe_loop():
+    # результат кэшируется: /readyz не ходит во внешние сервисы сам
+    while True:
+        beat("probe")
+        _probe("telegram", bot.get_me)
+        if notion: _probe("notion", notion.users.me)
+        time.sleep(PROBE_TTL_SEC)
+
+def readiness():
+    now = time.time()
+    workers = {n: {"state": worker_state(n, now), "beat_age_sec": round(now - HEARTBEATS.get(n, w["started"]), 1),
+                   "restarts": w["restarts"]} for n, w in WORKERS.items()}
+    for n in list(HEARTBEATS):   # отправители и журнал запускаются по требованию, в readiness не входят
+        if n.startswith(("tg-sender", "notion-log")): workers[n] = {"state": "lazy", "beat_age_sec": round(now - HEARTBEATS[n], 1)}
+    probes = {k: {**v, "age_sec": round(now - v["ts"], 1)} for k, v in PROBES.items()}
+    sched_age = round(now - SCHEDULE_CACHE_TS, 1) if SCHEDULE_CACHE_TS else None
+    problems = [f"{n} {w['state']}" for n, w in workers.items() if w["state"] not in ("ok", "lazy")]
+    for k in ["telegram"] + (["notion"] if notion else []):
+        pr = probes.get(k)
+        if not pr or not pr["ok"] or pr["age_sec"] > 3 * PROBE_TTL_SEC: problems.append(f"{k} probe failed")
+    if notion and NOTION_SCHEDULE_DB and (sched_age is None or sched_age > SCHEDULE_READY_MAX_SEC):
+        problems.append("schedule stale")
+    return {"ready": not problems, "problems": problems, "workers": workers, "probes": probes,
+            "schedule_age_sec": sched_age, "leader": is_leader(), "boot": BOOT, "startup_checks": STARTUP_PROBLEMS}
+
 # ---------- guard
 def only_me(func):
     @wraps(func)
@@ -65,9 +396,25 @@ def only_me(func):
         return func(update, context, *a, **k)
     return wrapper
 
+def subscriber_only(func):
+    # команды получателя: любой активный подписчик, не только владелец
+    @wraps(func)
+    def wrapper(update, context, *a, **k):
+        sub = SUBSCRIBERS.get(update.effective_chat.id)
+        if not (sub and sub["active"]):
+            update.message.reply_text("Сначала /start."); return
+        return func(update, context, sub, *a, **k)
+    return wrapper
+
 def args_text(context):
     return " ".join(context.args).strip() if context.args else ""
 
+def args_lines(update):
+    # текст после команды построчно — для пакетного ввода
+    parts = (update.message.text or "").split(None, 1)
+    rest = parts[1] if len(parts) > 1 else ""
+    return [l.strip() for l in rest.splitlines() if l.strip()]
+
 def _parse_kv(s):
     # "Task name; due=2025-08-10; priority=High"
     parts = [p.strip() for p in s.split(";") if p.strip()]
@@ -109,56 +456,373 @@ heartbeat_messages = [
     "Подними голову. Не сдавайся.",
 ]
 
+# ---------- message splitting (Telegram 4096, Notion rich_text 2000)
+TG_TEXT_MAX = 4096         # символов в одном сообщении
+NOTION_TEXT_MAX = 2000     # символов в одном rich_text
+NOTION_RICH_MAX = 100      # rich_text-элементов в одном свойстве
+
+def split_text(text, limit):
+    # куски не длиннее limit: режем по строкам, длинную строку — по пробелу, слово без пробелов — как есть
+    out, cur = [], ""
+    for line in (text or "").split("\n"):
+        while len(line) > limit:
+            cut = line.rfind(" ", 0, limit + 1)
+            if cut <= 0: cut = limit
+            head, line = line[:cut], line[cut:].lstrip(" ")
+            if cur: out.append(cur); cur = ""
+            out.append(head)
+        if cur and len(cur) + 1 + len(line) > limit: out.append(cur); cur = line
+        else: cur = f"{cur}\n{line}" if cur else line
+    if cur: out.append(cur)
+    return out
+
+def rich_text(text):
+    # длинный текст — несколькими сегментами; сверх лимита свойства — обрезка с пометкой
+    parts = split_text(text, NOTION_TEXT_MAX)
+    if len(parts) > NOTION_RICH_MAX:
+        parts = parts[:NOTION_RICH_MAX - 1] + [f"… (+{len(parts) - NOTION_RICH_MAX + 1} parts truncated)"]
+    return [{"type": "text", "text": {"content": c}} for c in parts]
+
 # ---------- helpers: Telegram
-def safe_send(text: str):
+@timed("safe_send")
+def safe_send(text: str, key=None, chat_id=None):
+    # сообщение ставится в outbox и уходит из отдельного потока; key защищает от повторной отправки
+    try:
+        enqueue_message(text, key, chat_id)
+        return True
+    except Exception as e:
+        report_error("outbox", e)
     try:
-        bot.send_message(chat_id=CHAT_ID, text=text)
+        for part in split_text(text, TG_TEXT_MAX) or [text or ""]: bot.send_message(chat_id=chat_id or CHAT_ID, text=part)
         log_to_notion("send", text, "ok")
         return True
     except Exception as e:
+        report_error("send", e)
         log_to_notion("send", text or "", f"error: {e}")
         return False
 
-def send_message(pool): 
-    if not PAUSED: safe_send(random.choice(pool))
-
-def send_morning(): send_message(morning_messages)
-def send_evening(): send_message(evening_messages)
-def send_day_message(): send_message(day_messages + heartbeat_messages)
-
-def send_weather():
-    if PAUSED: return
-    if not WEATHER_API_KEY:
-        safe_send("Погода недоступна: не задан WEATHER_API_KEY.")
-        return
+def reply_long(update, text, reply_markup=None):
+    # ответ на команду по частям, клавиатура — у последней
+    parts = split_text(text, TG_TEXT_MAX) or [text or ""]
+    for i, part in enumerate(parts):
+        update.message.reply_text(part, reply_markup=reply_markup if i == len(parts) - 1 else None)
+
+# ---------- outbox (durable Telegram delivery)
+OUTBOX_PATH = env("OUTBOX_PATH", data_path("outbox.sqlite3"))
+OUTBOX_MAX_ATTEMPTS = int(env("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_MAX_AGE_SEC = int(env("OUTBOX_MAX_AGE_SEC", "21600"))
+OUTBOX_KEEP_SEC = int(env("OUTBOX_KEEP_SEC", "259200"))
+TG_SENDERS = int(env("TG_SENDERS", "4"))
+TG_GLOBAL_RPS = float(env("TG_GLOBAL_RPS", "25"))              # Bot API: ~30 сообщений/с на бота
+TG_CHAT_INTERVAL_SEC = float(env("TG_CHAT_INTERVAL_SEC", "1"))  # и ~1/с в один чат
+TG_BUCKET = TokenBucket(TG_GLOBAL_RPS, max(1, int(TG_GLOBAL_RPS)))
+_outbox_db = None
+_outbox_lock = Lock()
+_outbox_cond = Condition(_outbox_lock)
+_outbox_cleaned = 0.0
+_senders = []
+_sending = set()      # чаты, чьё сообщение сейчас в полёте
+_chat_next = {}       # chat_id -> time.time(), раньше которого в чат не шлём
+
+def _outbox():
+    # вызывать под _outbox_lock
+    global _outbox_db
+    if _outbox_db is None:
+        db = sqlite3.connect(OUTBOX_PATH, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE, chat_id INTEGER, text TEXT,
+            status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,
+            next_at REAL, created REAL, error TEXT)""")
+        db.execute("CREATE INDEX IF NOT EXISTS outbox_status ON outbox(status, id)")
+        db.execute("CREATE INDEX IF NOT EXISTS outbox_chat ON outbox(status, chat_id, id)")
+        _outbox_db = db
+    return _outbox_db
+
+def enqueue_many(items):
+    # items: [(text, key, chat_id)] одной транзакцией -> сколько поставлено (key, который уже был, пропускается)
+    # длинный текст — несколько строк подряд (key, key#2, ...), sender шлёт их по id
+    now, n = time.time(), 0
+    with _outbox_lock:
+        db = _outbox()
+        db.execute("BEGIN")
+        try:
+            for text, key, chat_id in items:
+                key, chat_id = key or f"adhoc:{uuid.uuid4().hex}", chat_id or CHAT_ID
+                parts = split_text(text, TG_TEXT_MAX) or [text or ""]
+                rows = [(key if i == 0 else f"{key}#{i + 1}", chat_id, part, now, now) for i, part in enumerate(parts)]
+                if not db.execute("INSERT OR IGNORE INTO outbox(key, chat_id, text, next_at, created) VALUES (?,?,?,?,?)", rows[0]).rowcount: continue
+                db.executemany("INSERT OR IGNORE INTO outbox(key, chat_id, text, next_at, created) VALUES (?,?,?,?,?)", rows[1:])
+                n += 1
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK"); raise
+        if n: _outbox_cond.notify_all()
+    if n: start_sender()
+    return n
+
+def enqueue_message(text, key=None, chat_id=None):
+    # False — сообщение с таким key уже было
+    return enqueue_many([(text, key, chat_id)]) > 0
+
+def _outbox_update(oid, **fields):
+    cols = ", ".join(f"{k}=?" for k in fields)
+    with _outbox_lock: _outbox().execute(f"UPDATE outbox SET {cols} WHERE id=?", (*fields.values(), oid))
+
+def _outbox_cleanup():
+    with _outbox_lock:
+        _outbox().execute("DELETE FROM outbox WHERE status!='pending' AND created<?", (time.time() - OUTBOX_KEEP_SEC,))
+
+def start_sender():
+    if len(_senders) == TG_SENDERS and all(t.is_alive() for t in _senders): return
+    with _outbox_lock:
+        for i in range(TG_SENDERS):
+            if i < len(_senders) and _senders[i].is_alive(): continue
+            t = Thread(target=_sender_loop, name=f"tg-sender-{i}", daemon=True)
+            if i < len(_senders): _senders[i] = t
+            else: _senders.append(t)
+            t.start()
+
+def _outbox_claim():
+    # вызывать под _outbox_lock. Берём голову очереди каждого чата: один чат — строго по порядку и не чаще
+    # TG_CHAT_INTERVAL_SEC, разные чаты — параллельно. -> (row, None) или (None, сколько ждать | None)
+    now, wait = time.time(), None
+    for row in _outbox().execute(
+            "SELECT id, chat_id, text, attempts, next_at, created FROM outbox WHERE id IN "
+            "(SELECT MIN(id) FROM outbox WHERE status='pending' GROUP BY chat_id) ORDER BY id"):
+        if row[1] in _sending: continue
+        ready = max(row[4] or 0, _chat_next.get(row[1], 0))
+        if ready <= now:
+            _sending.add(row[1]); return row, None
+        wait = ready - now if wait is None else min(wait, ready - now)
+    return None, wait
+
+def _sender_loop():
+    global _outbox_cleaned
+    name = current_thread().name
+    while True:
+        beat(name)
+        with _outbox_lock:
+            try: row, wait = _outbox_claim()
+            except Exception as e: report_error("outbox read", e); row, wait = None, 5.0
+            if not row: _outbox_cond.wait(min(wait, 60) if wait is not None else 60)
+        if row: _deliver(row)
+        elif wait is None and time.time() - _outbox_cleaned > 600:
+            _outbox_cleaned = time.time()
+            try: _outbox_cleanup()
+            except Exception as e: report_error("outbox cleanup", e)
+
+def _deliver(row):
+    oid, chat_id, text, attempts, next_at, created = row
+    # в Notion-журнал — только сообщения владельца; рассылка считается в метриках
+    log = (lambda result: log_to_notion("send", text or "", result)) if chat_id == CHAT_ID else (lambda result: None)
+    try:
+        if time.time() - created > OUTBOX_MAX_AGE_SEC:
+            _outbox_update(oid, status="expired"); log("error: expired in outbox"); inc("connor_sent_total", status="expired"); return
+        TG_BUCKET.acquire()
+        try:
+            bot.send_message(chat_id=chat_id, text=text)
+            _outbox_update(oid, status="sent", attempts=attempts + 1)
+            log("ok"); inc("connor_sent_total", status="ok")
+        except RetryAfter as e:
+            TG_BUCKET.pause(e.retry_after)   # flood control — на весь бот, а не на один чат
+            _outbox_update(oid, next_at=time.time() + e.retry_after, error=str(e))
+        except (BadRequest, Unauthorized, ChatMigrated) as e:
+            _outbox_update(oid, status="failed", attempts=attempts + 1, error=str(e))
+            log(f"error: {e}"); inc("connor_sent_total", status="failed")
+            if isinstance(e, Unauthorized) and chat_id != CHAT_ID and chat_id in SUBSCRIBERS:
+                set_subscriber(chat_id, active=False)   # бот заблокирован — получатель выбывает
+        except Exception as e:
+            if attempts + 1 >= OUTBOX_MAX_ATTEMPTS:
+                _outbox_update(oid, status="failed", attempts=attempts + 1, error=str(e))
+                log(f"error: {e}"); inc("connor_sent_total", status="failed")
+            else:
+                _outbox_update(oid, attempts=attempts + 1, next_at=time.time() + min(2 ** attempts, 300), error=str(e))
+    finally:
+        with _outbox_lock:
+            _sending.discard(chat_id); _chat_next[chat_id] = time.time() + TG_CHAT_INTERVAL_SEC
+            _outbox_cond.notify_all()
+
+def weather_text(city, tz=seoul_tz):
+    if not WEATHER_API_KEY: return "Погода недоступна: не задан WEATHER_API_KEY."
     try:
-        url = "http://api.openweathermap.org/data/2.5/weather"
-        params = {"q": current_city, "appid": WEATHER_API_KEY, "lang": "ru", "units": "metric"}
-        r = requests.get(url, params=params, timeout=10)
-        r.raise_for_status()
-        d = r.json()
+        d, fetched, stale = fetch_weather(city)
         desc = d["weather"][0]["description"].capitalize()
         temp = d["main"]["temp"]; feels = d["main"]["feels_like"]; city = d["name"]
-        safe_send(f"🌤️ Погода в {city}:\n{desc}, температура: {temp}°C, ощущается как {feels}°C.")
     except Exception:
-        safe_send("Не удалось получить данные о погоде.")
+        report_error("weather send")
+        return "Не удалось получить данные о погоде."
+    msg = f"🌤️ Погода в {city}:\n{desc}, температура: {temp}°C, ощущается как {feels}°C."
+    if stale: msg += f"\n(данные на {datetime.fromtimestamp(fetched, tz):%H:%M} — свежие сейчас недоступны)"
+    return msg
+
+@timed("send_weather")
+def send_weather(key=None, chat_id=None, city=None):
+    if PAUSED and (chat_id or CHAT_ID) == CHAT_ID: return
+    safe_send(weather_text(city or current_city), key, chat_id)
+
+# ---------- weather (cache + single-flight)
+WEATHER_URL = env("WEATHER_URL", "http://api.openweathermap.org/data/2.5/weather")
+WEATHER_TTL_SEC = int(env("WEATHER_TTL_SEC", "300"))
+HTTP = requests.Session()        # keep-alive для OpenWeather
+WEATHER_CACHE = {}               # город -> (fetched_ts, data); старые значения храним для отдачи при сбое
+_weather_lock = Lock()
+_weather_inflight = {}           # город -> {"done": Event, "result": ...}
+
+@timed("fetch_weather")
+def fetch_weather(city):
+    # -> (data, fetched_ts, stale); одновременные запросы одного города ждут один HTTP-вызов
+    key = _norm(city)
+    with _weather_lock:
+        hit = WEATHER_CACHE.get(key)
+        if hit and time.time() - hit[0] < WEATHER_TTL_SEC: return hit[1], hit[0], False
+        flight = _weather_inflight.get(key)
+        leader = flight is None
+        if leader: flight = _weather_inflight[key] = {"done": Event(), "result": None}
+    if not leader:
+        flight["done"].wait(15)
+        res = flight["result"]
+    else:
+        res = None
+        try:
+            r = HTTP.get(WEATHER_URL, params={"q": city, "appid": WEATHER_API_KEY, "lang": "ru", "units": "metric"}, timeout=10)
+            r.raise_for_status()
+            d = r.json(); now = time.time()
+            with _weather_lock: WEATHER_CACHE[key] = (now, d)
+            res = (d, now, False)
+        except Exception as e:
+            report_error("weather", e)
+            res = (hit[1], hit[0], True) if hit else e
+        finally:
+            with _weather_lock: _weather_inflight.pop(key, None)
+            flight["result"] = res
+            flight["done"].set()
+    if res is None: raise RuntimeError("weather request timed out")
+    if isinstance(res, Exception): raise res
+    return res
 
 # ---------- Notion helpers
 def log_to_notion(kind: str, text: str, result: str):
+    # не блокирует: запись уходит в очередь, фоновый воркер пишет её в Notion
     if not (notion and NOTION_LOG_DB): return
+    entry = {"kind": kind, "text": text or "", "result": result, "when": datetime.now(seoul_tz).isoformat()}
+    _ensure_log_worker()
+    try: LOG_QUEUE.put_nowait(entry)
+    except queue.Full: _log_spill([entry])
+
+# ---------- Notion audit log (background writer)
+LOG_QUEUE_MAX = int(env("LOG_QUEUE_MAX", "500"))
+LOG_BATCH_MAX = int(env("LOG_BATCH_MAX", "25"))
+LOG_DOWN_COOLDOWN = int(env("LOG_DOWN_COOLDOWN", "120"))
+LOG_SPILL_PATH = env("LOG_SPILL_PATH", "notion_log_spill.jsonl")
+
+LOG_QUEUE = queue.Queue(maxsize=LOG_QUEUE_MAX)
+_log_lock = Lock()
+_log_worker = None
+_log_down_until = 0.0
+
+def _ensure_log_worker():
+    global _log_worker
+    if _log_worker and _log_worker.is_alive(): return
+    with _log_lock:
+        if _log_worker and _log_worker.is_alive(): return
+        _log_worker = Thread(target=_log_loop, name="notion-log", daemon=True)
+        _log_worker.start()
+
+def _log_props(e):
+    when = datetime.fromisoformat(e["when"])
+    result = e["result"] + (f" (×{e['count']})" if e.get("count", 1) > 1 else "")
+    return {
+        "Title": {"title": [{"text": {"content": f"{e['kind']} @ {when.strftime('%Y-%m-%d %H:%M')}"}}]},
+        "When": {"date": {"start": e["when"]}},
+        "Type": {"rich_text": [{"text": {"content": e["kind"]}}]},
+        "Text": {"rich_text": rich_text(e["text"])},
+        "Result": {"rich_text": rich_text(result)},
+    }
+
+def _coalesce(batch):
+    # одинаковые (kind, text, result) в одной пачке -> одна запись с счётчиком
+    out, seen = [], {}
+    for e in batch:
+        k = (e["kind"], e["text"], e["result"])
+        if k in seen: seen[k]["count"] = seen[k].get("count", 1) + e.get("count", 1)
+        else: seen[k] = dict(e); out.append(seen[k])
+    return out
+
+def _log_write(e):
+    # True — записано (или не подлежит повтору), False — Notion недоступен; повторы делает клиент
     try:
-        notion.pages.create(
-            parent={"database_id": NOTION_LOG_DB},
-            properties={
-                "Title": {"title": [{"text": {"content": f"{kind} @ {datetime.now(seoul_tz).strftime('%Y-%m-%d %H:%M')}"}}]},
-                "When": {"date": {"start": datetime.now(seoul_tz).isoformat()}},
-                "Type": {"rich_text": [{"text": {"content": kind}}]},
-                "Text": {"rich_text": [{"text": {"content": text or ""}}]},
-                "Result": {"rich_text": [{"text": {"content": result}}]},
-            }
-        )
+        notion.pages.create(parent={"database_id": NOTION_LOG_DB}, properties=_log_props(e))
+        return True
+    except HTTPResponseError as ex:
+        if ex.status in RETRYABLE_STATUS: return False
+        print("notion log dropped:", ex.status, ex)
+        return True
     except Exception:
-        pass
+        report_error("notion log")
+        return False
+
+def _log_drain(batch):
+    global _log_down_until
+    pending = _coalesce(batch)
+    if time.time() < _log_down_until:
+        _log_spill(pending); return
+    for i, e in enumerate(pending):
+        if not _log_write(e):
+            _log_down_until = time.time() + LOG_DOWN_COOLDOWN
+            _log_spill(pending[i:]); return
+
+def _log_spill(entries):
+    if not entries: return
+    with _log_lock:
+        try:
+            with open(LOG_SPILL_PATH, "a", encoding="utf-8") as f:
+                for e in entries: f.write(json.dumps(e, ensure_ascii=False) + "\n")
+        except Exception as ex:
+            report_error("notion log spill", ex)
+
+def _log_replay_spill():
+    if time.time() < _log_down_until or not os.path.exists(LOG_SPILL_PATH): return
+    rows = []
+    with _log_lock:
+        try:
+            with open(LOG_SPILL_PATH, encoding="utf-8") as f: lines = f.readlines()
+            os.remove(LOG_SPILL_PATH)
+        except Exception as ex:
+            report_error("notion log spill read", ex); return
+    for line in lines:
+        try: rows.append(json.loads(line))
+        except ValueError: pass
+    for i in range(0, len(rows), LOG_BATCH_MAX):
+        _log_drain(rows[i:i + LOG_BATCH_MAX])
+
+def _log_loop():
+    while True:
+        beat("notion-log")
+        try: first = LOG_QUEUE.get(timeout=30)
+        except queue.Empty:
+            _log_replay_spill(); continue
+        batch = [first]
+        while len(batch) < LOG_BATCH_MAX:
+            try: batch.append(LOG_QUEUE.get_nowait())
+            except queue.Empty: break
+        try: _log_drain(batch)
+        except Exception as ex: report_error("notion log", ex)
+        finally:
+            for _ in batch: LOG_QUEUE.task_done()
+
+def flush_notion_log(timeout=10.0):
+    # при остановке: даём воркеру дописать очередь, остаток — на диск
+    deadline = time.time() + timeout
+    while LOG_QUEUE.unfinished_tasks and _log_worker and _log_worker.is_alive() and time.time() < deadline:
+        time.sleep(0.1)
+    rest = []
+    while True:
+        try: rest.append(LOG_QUEUE.get_nowait())
+        except queue.Empty: break
+    _log_spill(_coalesce(rest))
+
+atexit.register(flush_notion_log)
 
 def rt_to_str(rich): 
     if not rich: return ""
@@ -170,114 +834,728 @@ def rt_to_str(rich):
 
 def q_str(x): return (x or "").strip()
 
-def find_by_title(db_id: str, title: str):
-    try:
-        resp = notion.databases.query(
-            database_id=db_id,
-            filter={"property": "Title", "title": {"contains": title}},
-            page_size=5
-        )
-        res = resp.get("results", [])
-        return res[0] if res else None
-    except Exception:
-        return None
+def query_all(db_id: str, **kw):
+    # все страницы запроса, лениво, по next_cursor
+    cursor = None
+    while True:
+        resp = notion.databases.query(database_id=db_id, start_cursor=cursor, page_size=100, **kw)
+        yield from resp.get("results", [])
+        if not resp.get("has_more"): break
+        cursor = resp.get("next_cursor")
 
-def create_page(db_id: str, props: dict):
-    return notion.pages.create(parent={"database_id": db_id}, properties=props)
+def sync_mark():
+    # last_edited_time в Notion округлён до минуты: начало минуты и минута запаса на расхождение часов
+    return (datetime.now(pytz.utc).replace(second=0, microsecond=0) - timedelta(minutes=1)).isoformat()
+
+def create_page(db_id: str, props: dict, children=None):
+    kw = {"children": children} if children else {}
+    page = notion.pages.create(parent={"database_id": db_id}, properties=props, **kw)
+    index_page(db_id, page)
+    return page
+
+NOTION_BLOCKS_MAX = 100    # блоков в одном create/append
+
+def text_blocks(text):
+    # markdown-лайт: «# »/«## »/«### » — заголовки, «- » — список, остальное — абзацы (пустая строка разделяет)
+    blocks, para = [], []
+    def block(kind, s):
+        return {"object": "block", "type": kind, kind: {"rich_text": [{"type": "text", "text": {"content": s}}]}}
+    def flush():
+        if para: blocks.extend(block("paragraph", c) for c in split_text("\n".join(para), NOTION_TEXT_MAX)); para.clear()
+    for line in (text or "").splitlines():
+        m = re.match(r"(#{1,3}) +(.*)|[-*] +(.*)", line)
+        if not line.strip(): flush()
+        elif m and m.group(1):
+            flush(); blocks.append(block(f"heading_{len(m.group(1))}", m.group(2)[:NOTION_TEXT_MAX]))
+        elif m:
+            flush(); blocks.extend(block("bulleted_list_item", c) for c in split_text(m.group(3), NOTION_TEXT_MAX))
+        else: para.append(line)
+    flush()
+    return blocks
+
+def append_blocks(page_id, blocks):
+    # по NOTION_BLOCKS_MAX за вызов, по порядку; append не идемпотентен — NotionClient.request повторяет его только на 429
+    for i in range(0, len(blocks), NOTION_BLOCKS_MAX):
+        notion.blocks.children.append(block_id=page_id, children=blocks[i:i + NOTION_BLOCKS_MAX])
+    return len(blocks)
 
 def update_page(page_id: str, props: dict):
-    return notion.pages.update(page_id=page_id, properties=props)
+    try:
+        page = notion.pages.update(page_id=page_id, properties=props)
+    except HTTPResponseError as e:
+        if e.status == 404: forget_page(page_id)
+        raise
+    index_page(page.get("parent",{}).get("database_id"), page)
+    return page
 
 # ---------- schedule (Notion)
+WEEKDAYS = ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
+DAY_ALIASES = {
+    "mon":"Mon","monday":"Mon","пн":"Mon","пон":"Mon","понедельник":"Mon",
+    "tue":"Tue","tuesday":"Tue","вт":"Tue","вторник":"Tue",
+    "wed":"Wed","wednesday":"Wed","ср":"Wed","среда":"Wed",
+    "thu":"Thu","thursday":"Thu","чт":"Thu","четверг":"Thu",
+    "fri":"Fri","friday":"Fri","пт":"Fri","пятница":"Fri",
+    "sat":"Sat","saturday":"Sat","сб":"Sat","суббота":"Sat",
+    "sun":"Sun","sunday":"Sun","вс":"Sun","воскресенье":"Sun",
+}
+
 def parse_days_str(s: str):
     if not s: return []
     s = s.strip().lower()
     if s in ("daily","ежедневно","everyday"):
-        return ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
+        return list(WEEKDAYS)
     parts = [p.strip() for p in s.replace(";",",").split(",") if p.strip()]
-    map_short = {
-        "mon":"Mon","monday":"Mon","пн":"Mon","пон":"Mon","понедельник":"Mon",
-        "tue":"Tue","tuesday":"Tue","вт":"Tue","вторник":"Tue",
-        "wed":"Wed","wednesday":"Wed","ср":"Wed","среда":"Wed",
-        "thu":"Thu","thursday":"Thu","чт":"Thu","четверг":"Thu",
-        "fri":"Fri","friday":"Fri","пт":"Fri","пятница":"Fri",
-        "sat":"Sat","saturday":"Sat","сб":"Sat","суббота":"Sat",
-        "sun":"Sun","sunday":"Sun","вс":"Sun","воскресенье":"Sun",
+    return [DAY_ALIASES.get(p, p[:3].title()) for p in parts]
+
+def parse_time_str(s: str):
+    # "8:00", "08:00", "8.00", "0800" -> минута суток; None, если не распознано
+    s = (s or "").strip().replace(".", ":")
+    if ":" in s: h, _, m = s.partition(":")
+    elif s.isdigit() and len(s) in (3, 4): h, m = s[:-2], s[-2:]
+    else: return None
+    if not (h.isdigit() and m.isdigit() and len(m) == 2): return None
+    h, m = int(h), int(m)
+    return h*60 + m if 0 <= h < 24 and 0 <= m < 60 else None
+
+def compile_schedule(rows):
+    # строки расписания -> {(weekday, minute_of_day): [entries]} + список ошибок
+    index, errors = {}, []
+    for e in rows:
+        mod = parse_time_str(e.get("time"))
+        if mod is None:
+            errors.append(f"{e.get('title')}: неверное время {e.get('time')!r}"); continue
+        days, bad = set(), []
+        for d in e.get("days") or []:
+            k = DAY_ALIASES.get((d or "").strip().lower())
+            if k: days.add(WEEKDAYS.index(k))
+            else: bad.append(d)
+        if bad:
+            errors.append(f"{e.get('title')}: неизвестные дни {', '.join(map(str, bad))}")
+            if not days: continue
+        e["time"] = f"{mod//60:02d}:{mod%60:02d}"
+        for wd in sorted(days) if days else range(7):
+            index.setdefault((wd, mod), []).append(e)
+    return index, errors
+
+def schedule_row(r):
+    p=r.get("properties",{})
+    tname = p.get("Type",{}).get("select",{}).get("name","")
+    time_str = rt_to_str(p.get("Time",{}).get("rich_text",[])) or "00:00"
+    days_ms = p.get("Days",{}).get("multi_select",[]) or []
+    text = rt_to_str(p.get("Text",{}).get("rich_text",[]))
+    cat  = rt_to_str(p.get("TemplateCategory",{}).get("rich_text",[]))
+    title= rt_to_str(p.get("Title",{}).get("title",[])) or "scheduled"
+    return {
+        "id": r["id"],
+        "title": title,
+        "type": (tname or "custom").lower(),
+        "time": time_str,
+        "days": [d.get("name") for d in days_ms],
+        "text": text,
+        "template_category": cat,
+        "active": bool(p.get("Enabled",{}).get("checkbox")) and not (r.get("archived") or r.get("in_trash")),
     }
-    return [map_short.get(p, p[:3].title()) for p in parts]
 
-def days_match_today(days_list):
-    if not days_list: return True
-    idx = datetime.now(seoul_tz).weekday()
-    return ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"][idx] in set(days_list)
-
-def fetch_schedule_rows():
+@timed("fetch_schedule_rows")
+def fetch_schedule_rows(since=None):
+    # since=None — все включённые строки; иначе всё, что менялось с since (в т.ч. выключенное)
     if not (notion and NOTION_SCHEDULE_DB): return []
-    items, cursor = [], None
-    while True:
-        resp = notion.databases.query(
-            database_id=NOTION_SCHEDULE_DB,
-            filter={"property":"Enabled","checkbox":{"equals": True}},
-            start_cursor=cursor, page_size=100
-        )
-        items += resp.get("results", [])
-        if not resp.get("has_more"): break
-        cursor = resp.get("next_cursor")
+    if since: flt = {"timestamp":"last_edited_time","last_edited_time":{"on_or_after": since}}
+    else: flt = {"property":"Enabled","checkbox":{"equals": True}}
+    return [schedule_row(r) for r in query_all(NOTION_SCHEDULE_DB, filter=flt)]
+
+_schedule_lock = Lock()
+
+def reload_schedule(force=False, full=False):
+    with _schedule_lock:
+        now_ts = int(time.time())
+        if not force and (now_ts - SCHEDULE_CACHE_TS) < SCHEDULE_REFRESH_SEC: return
+        _sync_schedule(now_ts, full)
+
+def _sync_schedule(now_ts, full):
+    global SCHEDULE_CACHE, SCHEDULE_CACHE_TS, SCHEDULE_INDEX, SCHEDULE_ERRORS
+    global SCHEDULE_ROWS, SCHEDULE_FULL_SYNC_TS, SCHEDULE_SYNCED_AT
+    full = full or not SCHEDULE_SYNCED_AT or (now_ts - SCHEDULE_FULL_SYNC_TS) >= SCHEDULE_FULL_RESYNC_SEC
+    synced_at = sync_mark()
+    changed = fetch_schedule_rows(None if full else SCHEDULE_SYNCED_AT)
+    SCHEDULE_CACHE_TS, SCHEDULE_SYNCED_AT = now_ts, synced_at
+    if full: SCHEDULE_FULL_SYNC_TS = now_ts
+    elif not changed: return
+
+    # архивные страницы запрос не возвращает — их убирает полная синхронизация
+    rows = {} if full else dict(SCHEDULE_ROWS)
+    for r in changed:
+        if r["active"]: rows[r["id"]] = r
+        else: rows.pop(r["id"], None)
+    index, errors = compile_schedule(list(rows.values()))
+    if errors and errors != SCHEDULE_ERRORS:
+        for err in errors: print("schedule:", err)
+        log_to_notion("schedule", "\n".join(errors), "invalid rows")
+    SCHEDULE_ROWS = rows
+    SCHEDULE_CACHE, SCHEDULE_INDEX, SCHEDULE_ERRORS = list(rows.values()), index, errors
+    schedule_changed()
+
+# ---------- template pools (TTL + LRU, stale-while-revalidate)
+TEMPLATE_TTL_SEC = int(env("TEMPLATE_TTL_SEC", "600"))
+TEMPLATE_CACHE_MAX = int(env("TEMPLATE_CACHE_MAX", "32"))
+TEMPLATE_CACHE = OrderedDict()   # category -> {"pool": [...], "ts": fetched_at, "valid": bool}
+_tpl_lock = Lock()
+_tpl_refreshing = set()
+
+@timed("fetch_template_pool")
+def fetch_template_pool(cat):
+    pool = []
+    for pg in query_all(NOTION_TEMPLATES_DB, filter={"property":"Category","rich_text":{"equals": cat}}):
+        t = rt_to_str(pg.get("properties",{}).get("Text",{}).get("rich_text",[]))
+        if t: pool.append(t)
+    return pool
+
+def _tpl_store(cat, pool):
+    with _tpl_lock:
+        TEMPLATE_CACHE[cat] = {"pool": pool, "ts": time.time(), "valid": True}
+        TEMPLATE_CACHE.move_to_end(cat)
+        while len(TEMPLATE_CACHE) > TEMPLATE_CACHE_MAX:
+            TEMPLATE_CACHE.popitem(last=False)
+
+def _tpl_refresh(cat):
+    try: _tpl_store(cat, fetch_template_pool(cat))
+    except Exception as e: report_error("template refresh", e)
+    finally:
+        with _tpl_lock: _tpl_refreshing.discard(cat)
+
+def get_template_pool(cat):
+    if not (notion and NOTION_TEMPLATES_DB and cat): return []
+    with _tpl_lock:
+        hit = TEMPLATE_CACHE.get(cat)
+        if hit:
+            TEMPLATE_CACHE.move_to_end(cat)
+            if hit["valid"]:
+                # свежий — сразу; устаревший — тоже сразу, но обновляем в фоне
+                if time.time() - hit["ts"] >= TEMPLATE_TTL_SEC and cat not in _tpl_refreshing:
+                    _tpl_refreshing.add(cat)
+                    Thread(target=_tpl_refresh, args=(cat,), daemon=True).start()
+                return hit["pool"]
+    # промах или инвалидирован: читаем синхронно, при сбое — последний известный пул
+    try:
+        pool = fetch_template_pool(cat)
+    except Exception as e:
+        report_error("template fetch", e)
+        return hit["pool"] if hit else []
+    _tpl_store(cat, pool)
+    return pool
 
-    rows=[]
-    for r in items:
-        p=r.get("properties",{})
-        tname = p.get("Type",{}).get("select",{}).get("name","")
-        time_str = rt_to_str(p.get("Time",{}).get("rich_text",[])) or "00:00"
-        days_ms = p.get("Days",{}).get("multi_select",[]) or []
-        text = rt_to_str(p.get("Text",{}).get("rich_text",[]))
-        cat  = rt_to_str(p.get("TemplateCategory",{}).get("rich_text",[]))
-        title= rt_to_str(p.get("Title",{}).get("title",[])) or "scheduled"
-        rows.append({
-            "id": r["id"],
-            "title": title,
-            "type": (tname or "custom").lower(),
-            "time": time_str,
-            "days": [d.get("name") for d in days_ms],
-            "text": text,
-            "template_category": cat
-        })
-    return rows
-
-def reload_schedule(force=False):
-    global SCHEDULE_CACHE, SCHEDULE_CACHE_TS
-    now_ts = int(time.time())
-    if not force and (now_ts - SCHEDULE_CACHE_TS) < SCHEDULE_REFRESH_SEC: return
-    SCHEDULE_CACHE = fetch_schedule_rows()
-    SCHEDULE_CACHE_TS = now_ts
+def invalidate_templates(cat=None):
+    with _tpl_lock:
+        for k, v in TEMPLATE_CACHE.items():
+            if cat is None or k == cat: v["valid"] = False
 
 def build_message_from_entry(entry):
     if entry.get("type") == "weather": return None
     if entry.get("text"): return entry["text"]
     cat = entry.get("template_category") or entry.get("type") or "day"
-    if notion and NOTION_TEMPLATES_DB and cat:
-        try:
-            resp = notion.databases.query(
-                database_id=NOTION_TEMPLATES_DB,
-                filter={"property":"Category","rich_text":{"equals": cat}},
-                page_size=100
-            )
-            pool = [rt_to_str(pg["properties"]["Text"]["rich_text"]) for pg in resp.get("results",[])]
-            if pool: return random.choice(pool)
-        except Exception:
-            pass
+    pool = get_template_pool(cat)
+    if pool: return random.choice(pool)
     defaults={"morning":morning_messages,"evening":evening_messages,"pulse":heartbeat_messages,"day":day_messages}
     return random.choice(defaults.get(cat, day_messages))
 
+@timed("run_scheduled_from_notion")
 def run_scheduled_from_notion(now_dt):
-    if not SCHEDULE_CACHE: return
-    hhmm = now_dt.strftime("%H:%M")
-    for e in SCHEDULE_CACHE:
-        if e.get("time")==hhmm and days_match_today(e.get("days",[])):
-            if e.get("type") == "weather": send_weather()
-            else:
-                msg = build_message_from_entry(e)
-                if msg: safe_send(msg)
+    for e in SCHEDULE_INDEX.get((now_dt.weekday(), now_dt.hour*60 + now_dt.minute), ()):
+        key = f"notion:{e['id']}@{now_dt:%Y-%m-%dT%H:%M}"
+        if e.get("type") == "weather": send_weather(key)
+        else:
+            msg = build_message_from_entry(e)
+            if msg: safe_send(msg, key)
+
+# ---------- fire ledger + leader lease
+LEDGER_BACKEND = env("LEDGER_BACKEND", "sqlite")
+LEDGER_PATH = env("LEDGER_PATH", data_path("ledger.sqlite3"))
+LEASE_TTL_SEC = int(env("LEASE_TTL_SEC", "30"))
+FIRE_STALE_SEC = int(env("FIRE_STALE_SEC", "120"))
+LEDGER_KEEP_DAYS = int(env("LEDGER_KEEP_DAYS", "14"))
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+class FireLedger(ABC):
+    # интерфейс хранилища; общие для нескольких хостов реализации регистрируются в LEDGER_BACKENDS
+    @abstractmethod
+    def claim(self, job_id, planned, owner):
+        # True — этот экземпляр должен выполнить срабатывание (job_id, planned)
+        ...
+    @abstractmethod
+    def done(self, job_id, planned): ...
+    @abstractmethod
+    def release(self, job_id, planned, owner): ...   # снять свой незавершённый захват
+    @abstractmethod
+    def is_done(self, job_id, planned): ...
+    @abstractmethod
+    def acquire_lease(self, name, owner, ttl): ...
+    @abstractmethod
+    def release_lease(self, name, owner): ...
+    @abstractmethod
+    def prune(self, before_ts): ...
+
+class SqliteLedger(FireLedger):
+    # координирует процессы, у которых общий файл (один хост / общий диск)
+    def __init__(self, path):
+        self.path, self.db, self.lock = path, None, Lock()
+
+    def _conn(self):
+        if self.db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS fires (
+                job_id TEXT NOT NULL, planned TEXT NOT NULL, owner TEXT, status TEXT, ts REAL,
+                PRIMARY KEY (job_id, planned))""")
+            db.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+            self.db = db
+        return self.db
+
+    def claim(self, job_id, planned, owner):
+        # «running» чужого владельца, зависший дольше FIRE_STALE_SEC, можно перехватить: отправки всё равно идут по ключу outbox
+        now = time.time()
+        with self.lock:
+            cur = self._conn().execute(
+                """INSERT INTO fires(job_id, planned, owner, status, ts) VALUES (?,?,?,'running',?)
+                   ON CONFLICT(job_id, planned) DO UPDATE SET owner=excluded.owner, ts=excluded.ts
+                   WHERE fires.status='running' AND fires.owner!=excluded.owner AND fires.ts<?""",
+                (job_id, planned, owner, now, now - FIRE_STALE_SEC))
+            return cur.rowcount > 0
+
+    def done(self, job_id, planned):
+        with self.lock:
+            self._conn().execute("UPDATE fires SET status='done', ts=? WHERE job_id=? AND planned=?", (time.time(), job_id, planned))
+
+    def release(self, job_id, planned, owner):
+        with self.lock:
+            self._conn().execute("DELETE FROM fires WHERE job_id=? AND planned=? AND owner=? AND status='running'", (job_id, planned, owner))
+
+    def is_done(self, job_id, planned):
+        with self.lock:
+            return self._conn().execute("SELECT 1 FROM fires WHERE job_id=? AND planned=? AND status='done'", (job_id, planned)).fetchone() is not None
+
+    def acquire_lease(self, name, owner, ttl):
+        with self.lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT owner, expires FROM leases WHERE name=?", (name,)).fetchone()
+                now = time.time()
+                ok = row is None or row[0] == owner or row[1] < now
+                if ok: db.execute("INSERT OR REPLACE INTO leases(name, owner, expires) VALUES (?,?,?)", (name, owner, now + ttl))
+                db.execute("COMMIT")
+                return ok
+            except Exception:
+                db.execute("ROLLBACK"); raise
+
+    def release_lease(self, name, owner):
+        with self.lock:
+            self._conn().execute("DELETE FROM leases WHERE name=? AND owner=?", (name, owner))
+
+    def prune(self, before_ts):
+        with self.lock:
+            self._conn().execute("DELETE FROM fires WHERE ts<?", (before_ts,))
+
+LEDGER_BACKENDS = {"sqlite": SqliteLedger}
+LEDGER = LEDGER_BACKENDS[LEDGER_BACKEND](LEDGER_PATH)
+_leader = False
+
+def is_leader(): return _leader
+
+def run_leader_loop():
+    # планировщиком занимается только держатель аренды «scheduler»
+    global _leader
+    last_prune = 0.0
+    while True:
+        beat("leader")
+        try: got = LEDGER.acquire_lease("scheduler", INSTANCE_ID, LEASE_TTL_SEC)
+        except Exception as e: report_error("lease", e); got = False
+        if got and not _leader:
+            print("scheduler: lease acquired by", INSTANCE_ID)
+            _sched_rewind()   # догоняем то, что пропустили, пока лидером был кто-то другой (или никто)
+        elif _leader and not got:
+            print("scheduler: lease lost")
+        _leader = got
+        if got and time.time() - last_prune > 3600:
+            try: LEDGER.prune(time.time() - LEDGER_KEEP_DAYS * 86400); last_prune = time.time()
+            except Exception as e: report_error("ledger prune", e)
+        time.sleep(LEASE_TTL_SEC / 3)
+
+def release_leadership():
+    if _leader:
+        try: LEDGER.release_lease("scheduler", INSTANCE_ID)
+        except Exception: pass
+
+atexit.register(release_leadership)
+
+# ---------- subscribers (получатели: пояс, город, пауза, своё время)
+SUBSCRIBERS_PATH = env("SUBSCRIBERS_PATH", data_path("subscribers.sqlite3"))
+OPEN_SUBSCRIPTIONS = env("OPEN_SUBSCRIPTIONS", "0") == "1"   # иначе /start принимает только приглашённых (/invite)
+SUBSCRIBERS = {}   # chat_id -> {chat_id, tz, city, paused, overrides: {job: "HH:MM" | "off"}, active}
+_subs_lock = Lock()
+_subs_db = None
+
+def _subs():
+    # вызывать под _subs_lock
+    global _subs_db
+    if _subs_db is None:
+        db = sqlite3.connect(SUBSCRIBERS_PATH, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""CREATE TABLE IF NOT EXISTS subscribers (
+            chat_id INTEGER PRIMARY KEY, tz TEXT NOT NULL, city TEXT, paused INTEGER NOT NULL DEFAULT 0,
+            overrides TEXT NOT NULL DEFAULT '{}', active INTEGER NOT NULL DEFAULT 1, created REAL)""")
+        _subs_db = db
+    return _subs_db
+
+def load_subscribers():
+    with _subs_lock:
+        SUBSCRIBERS.clear()
+        for chat_id, tz, city, paused, overrides, active in _subs().execute(
+                "SELECT chat_id, tz, city, paused, overrides, active FROM subscribers"):
+            SUBSCRIBERS[chat_id] = {"chat_id": chat_id, "tz": tz, "city": city or CITY_NAME, "paused": bool(paused),
+                                    "overrides": json.loads(overrides or "{}"), "active": bool(active)}
+    owner = SUBSCRIBERS.get(CHAT_ID)
+    if not (owner and owner["active"]): set_subscriber(CHAT_ID, active=True)   # владелец — получатель всегда
+    else: subscribers_changed()
+
+def set_subscriber(chat_id, **fields):
+    with _subs_lock:
+        sub = dict(SUBSCRIBERS.get(chat_id) or {"chat_id": chat_id, "tz": seoul_tz.zone, "city": CITY_NAME,
+                                                "paused": False, "overrides": {}, "active": True})
+        sub.update(fields)
+        _subs().execute(
+            "INSERT INTO subscribers(chat_id, tz, city, paused, overrides, active, created) VALUES (?,?,?,?,?,?,?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET tz=excluded.tz, city=excluded.city, paused=excluded.paused, "
+            "overrides=excluded.overrides, active=excluded.active",
+            (chat_id, sub["tz"], sub["city"], int(sub["paused"]), json.dumps(sub["overrides"]), int(sub["active"]), time.time()))
+        SUBSCRIBERS[chat_id] = sub
+    subscribers_changed()
+    return sub
+
+def subscribe(chat_id):
+    # /start -> текст ответа; владелец всегда может вернуть себе рассылку
+    if chat_id == CHAT_ID:
+        if not SUBSCRIBERS.get(CHAT_ID, {}).get("active"): set_subscriber(CHAT_ID, active=True)
+        return "Привет, Лиза. Я активен. /help — список команд."
+    if chat_id not in SUBSCRIBERS and not OPEN_SUBSCRIPTIONS: return "⛔️ Доступ запрещён."
+    set_subscriber(chat_id, active=True)
+    return "Привет. Я рядом: утром, днём и вечером.\n/settings — пояс, город и время; /pause, /resume; /weather; /stop — отписаться."
+
+def unsubscribe(chat_id):
+    if chat_id == CHAT_ID: return "Владелец не отписывается: /pause — тишина, /resume — вернуть."
+    set_subscriber(chat_id, active=False)
+    return "Отписал. /start — вернуться."
+
+def parse_settings(text, sub):
+    # "tz=Europe/Berlin; city=Berlin; morning=07:30; evening=off; day=on" -> (поля для set_subscriber, ошибки)
+    _, kv = _parse_kv(text or "")
+    fields, overrides, errors = {}, dict(sub["overrides"]), []
+    for k, v in kv.items():
+        if k == "tz":
+            try: fields["tz"] = pytz.timezone(v).zone
+            except pytz.UnknownTimeZoneError: errors.append(f"tz: неизвестный пояс {v}")
+        elif k == "city": fields["city"] = v
+        elif k in FIXED_JOBS:
+            if v.lower() in ("on", "default"): overrides.pop(k, None)
+            elif v.lower() == "off": overrides[k] = "off"
+            elif k != "day" and parse_time_str(v) is not None:
+                mod = parse_time_str(v); overrides[k] = f"{mod // 60:02d}:{mod % 60:02d}"
+            else: errors.append(f"{k}: ожидается HH:MM, off или on" if k != "day" else "day: off или on")
+        else: errors.append(f"неизвестный параметр {k}")
+    if overrides != sub["overrides"]: fields["overrides"] = overrides
+    return fields, errors
+
+def describe_subscriber(sub):
+    jobs = ", ".join(f"{j} {sub['overrides'].get(j, 'по умолчанию')}" for j in FIXED_JOBS)
+    return f"Пояс: {sub['tz']}\nГород: {sub['city']}\nПауза: {'да' if sub['paused'] else 'нет'}\n{jobs}"
+
+# ---------- scheduler (next-fire heap, ведра по местной минуте получателей)
+MISFIRE_GRACE_SEC = int(env("MISFIRE_GRACE_SEC", "300"))
+DAILY = range(7)
+FIXED_JOBS = {   # job id -> (слоты (weekday, minute_of_day) по местному времени получателя, текст для получателя)
+    "morning": ({(d, 8*60) for d in DAILY}, lambda sub: random.choice(morning_messages)),
+    "evening": ({(d, 22*60) for d in DAILY}, lambda sub: random.choice(evening_messages)),
+    "weather": ({(d, 8*60 + 30) for d in DAILY}, lambda sub: weather_text(sub["city"], pytz.timezone(sub["tz"]))),
+    "day":     ({(d, h*60 + 15) for d in DAILY for h in range(0, 24, 2)}, lambda sub: random.choice(day_messages + heartbeat_messages)),
+}
+BUCKETS = {}             # bucket id -> {job, tz, slots, chats}; пересобирается целиком при изменении получателей
+SCHED_HEAP = []          # (planned_dt, job_id): job_id — bucket id или "notion"
+SCHED_COND = Condition()
+_sched_dirty = set()     # "notion" и/или "buckets"
+_sched_started = None
+_sched_last = {}         # job id -> последнее обработанное плановое время
+
+def _bucket_of(sub, job):
+    # (bucket id, слоты) или (None, None), если задача у получателя выключена
+    ov = sub["overrides"].get(job)
+    if ov == "off": return None, None
+    bid = job if sub["tz"] == seoul_tz.zone else f"{job}|{sub['tz']}"   # владелец в поясе по умолчанию — прежние ключи
+    if ov:
+        h, m = map(int, ov.split(":"))
+        return f"{bid}|{ov}", {(d, h*60 + m) for d in DAILY}
+    return bid, FIXED_JOBS[job][0]
+
+def rebuild_buckets():
+    # получатели с одинаковыми (задача, пояс, время) срабатывают одним ведром — одна запись в куче на всех
+    buckets = {}
+    with _subs_lock: subs = [dict(x) for x in SUBSCRIBERS.values() if x["active"]]
+    for sub in subs:
+        for job in FIXED_JOBS:
+            if job == "weather" and not WEATHER_API_KEY: continue   # без ключа рассылать нечего, кроме ошибки настройки
+            bid, slots = _bucket_of(sub, job)
+            if bid: buckets.setdefault(bid, {"job": job, "tz": pytz.timezone(sub["tz"]), "slots": slots, "chats": []})["chats"].append(sub["chat_id"])
+    return buckets
+
+def job_slots(job_id):
+    return SCHEDULE_INDEX.keys() if job_id == "notion" else BUCKETS[job_id]["slots"]
+
+def job_tz(job_id):
+    return seoul_tz if job_id == "notion" else BUCKETS[job_id]["tz"]
+
+def next_fire(slots, after, tz=seoul_tz):
+    # ближайший слот строго после after; слоты — местное время tz (через localize, чтобы переходы на летнее время не сдвигали минуту)
+    local = after.astimezone(tz)
+    base = local.replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    best = None
+    for wd, mod in slots:
+        naive = base + timedelta(days=(wd - local.weekday()) % 7, minutes=mod)
+        t = tz.localize(naive)
+        if t <= after: t = tz.localize(naive + timedelta(days=7))
+        if best is None or t < best: best = t
+    return best
+
+def schedule_changed():
+    # будит планировщик: слоты Notion пересчитываются до следующего ожидания
+    with SCHED_COND:
+        _sched_dirty.add("notion")
+        SCHED_COND.notify_all()
+
+def subscribers_changed():
+    with SCHED_COND:
+        _sched_dirty.add("buckets")
+        SCHED_COND.notify_all()
+
+def _sched_push(job_id, after=None):
+    if job_id != "notion" and job_id not in BUCKETS: return
+    t = next_fire(job_slots(job_id), _sched_last.get(job_id) or after or _sched_started, job_tz(job_id))
+    if t: heapq.heappush(SCHED_HEAP, (t, job_id))
+
+def _sched_refresh(now):
+    # вызывать под SCHED_COND: пересчитать только изменившееся; новое ведро стартует с now, а не с начала догонки
+    global BUCKETS
+    dirty = set(_sched_dirty); _sched_dirty.clear()
+    if "buckets" in dirty:
+        BUCKETS = rebuild_buckets()
+        dirty |= {job_id for _, job_id in SCHED_HEAP if job_id != "notion"} | set(BUCKETS)
+        dirty.discard("buckets")
+    SCHED_HEAP[:] = [x for x in SCHED_HEAP if x[1] not in dirty]
+    heapq.heapify(SCHED_HEAP)
+    for job_id in dirty: _sched_push(job_id, None if job_id == "notion" else now)
+
+def _sched_take_due():
+    with SCHED_COND:
+        while True:
+            beat("scheduler")
+            now = datetime.now(seoul_tz)
+            if _sched_dirty: _sched_refresh(now)
+            if SCHED_HEAP and SCHED_HEAP[0][0] <= now:
+                planned, job_id = heapq.heappop(SCHED_HEAP)
+                _sched_last[job_id] = planned
+                _sched_push(job_id)
+                return planned, job_id
+            wait = (SCHED_HEAP[0][0] - now).total_seconds() if SCHED_HEAP else 60
+            SCHED_COND.wait(timeout=min(max(wait, 0.05), 60))
+
+def _sched_rewind():
+    # пересобрать кучу с отступом MISFIRE_GRACE_SEC назад: пропущенное догонится, уже сделанное отсечёт журнал
+    global _sched_started, BUCKETS
+    with SCHED_COND:
+        _sched_started = datetime.now(seoul_tz) - timedelta(seconds=MISFIRE_GRACE_SEC)
+        _sched_last.clear(); SCHED_HEAP.clear(); _sched_dirty.clear()
+        BUCKETS = rebuild_buckets()
+        for job_id in ["notion"] + list(BUCKETS): _sched_push(job_id)
+        SCHED_COND.notify_all()
+
+def _sched_run(job_id, planned):
+    slot = f"{planned:%Y-%m-%dT%H:%M}"
+    try:
+        if job_id == "notion": run_scheduled_from_notion(planned)
+        else: fan_out(job_id, slot)
+        LEDGER.done(job_id, slot)
+    except Exception as e:
+        report_error(f"job {job_id}", e)
+
+@timed("fan_out")
+def fan_out(bucket_id, slot):
+    # срабатывание ведра -> по сообщению каждому активному получателю, одной транзакцией в outbox;
+    # темп доставки держат отправители (TG_GLOBAL_RPS, TG_CHAT_INTERVAL_SEC)
+    b = BUCKETS.get(bucket_id)
+    if not b: return 0
+    with _subs_lock:   # PAUSED (команда pause из Notion) — пауза владельца, остальные живут по своему флагу
+        subs = [dict(SUBSCRIBERS[c]) for c in b["chats"] if c in SUBSCRIBERS and SUBSCRIBERS[c]["active"]
+                and not SUBSCRIBERS[c]["paused"] and not (PAUSED and c == CHAT_ID)]
+    build, items = FIXED_JOBS[b["job"]][1], []
+    for sub in subs:
+        text = build(sub)
+        key = f"{bucket_id}@{slot}" + ("" if sub["chat_id"] == CHAT_ID else f":{sub['chat_id']}")
+        if text: items.append((text, key, sub["chat_id"]))
+    n = enqueue_many(items)
+    inc("connor_fanout_messages_total", n, job=b["job"])
+    return n
+
+def run_scheduler():
+    _sched_rewind()
+    boot_mark("first_tick")
+    while True:
+        planned, job_id = _sched_take_due()
+        lag = (datetime.now(seoul_tz) - planned).total_seconds()
+        if lag > MISFIRE_GRACE_SEC:
+            print(f"scheduler: missed {job_id} @ {planned:%Y-%m-%d %H:%M} (lag {lag:.0f}s)")
+            inc("connor_scheduler_missed_total", job=job_id.split("|")[0])
+            continue
+        observe("connor_scheduler_lag_seconds", max(lag, 0.0), job=job_id.split("|")[0])
+        if not is_leader(): continue
+        try:
+            if not LEDGER.claim(job_id, f"{planned:%Y-%m-%dT%H:%M}", INSTANCE_ID): continue   # уже отработано
+        except Exception as e:
+            report_error("ledger", e)   # журнал недоступен — лучше отправить, outbox отсечёт дубли
+        # каждое срабатывание — в своём потоке, чтобы медленный Notion не задерживал следующие
+        Thread(target=_sched_run, args=(job_id, planned), daemon=True).start()
+
+def run_schedule_sync_loop():
+    while True:
+        beat("schedule-sync")
+        try: reload_schedule(force=False)
+        except Exception as e: report_error("schedule reload", e)
+        time.sleep(30)
+
+# ---------- title index (To-Do / Projects / Jobs)
+INDEX_REFRESH_SEC = int(env("INDEX_REFRESH_SEC", "60"))
+INDEX_FULL_RESYNC_SEC = int(env("INDEX_FULL_RESYNC_SEC", "21600"))
+FUZZY_CUTOFF = float(env("FUZZY_CUTOFF", "0.75"))
+
+def _dbk(db_id): return (db_id or "").replace("-", "").lower()
+
+INDEXED_DBS = {_dbk(db): (db, title_prop, alt_prop) for db, title_prop, alt_prop in (
+    (NOTION_TODO_DB, "Title", None),
+    (NOTION_PROJECTS_DB, "Name", None),
+    (NOTION_JOBS_DB, "Role", "Company"),
+    (NOTION_WEBSITE_DB, "Title", None),
+) if db}
+TITLE_INDEX = {}   # db key -> {"pages": {page_id: (title, alt)}, "keys": {norm: {page_id}}, "synced_at": iso, "full_ts": ts}
+_index_lock = Lock()
+
+def _norm(s): return " ".join((s or "").casefold().split())
+
+def _new_index(): return {"pages": {}, "keys": {}, "synced_at": None, "full_ts": 0}
+
+def _index_drop(idx, page_id):
+    old = idx["pages"].pop(page_id, None)
+    for k in set(old or ()):
+        ids = idx["keys"].get(_norm(k))
+        if ids is not None:
+            ids.discard(page_id)
+            if not ids: del idx["keys"][_norm(k)]
+
+def _index_put(idx, key, page):
+    _, title_prop, alt_prop = INDEXED_DBS[key]
+    _index_drop(idx, page["id"])
+    if page.get("archived") or page.get("in_trash"): return
+    p = page.get("properties", {})
+    title = rt_to_str(p.get(title_prop, {}).get("title", []))
+    alt = rt_to_str(p.get(alt_prop, {}).get("rich_text", [])) if alt_prop else ""
+    _index_set(idx, page["id"], title, alt)
+
+def _index_set(idx, page_id, title, alt):
+    idx["pages"][page_id] = (title, alt)
+    for k in {_norm(title), _norm(alt)} - {""}:
+        idx["keys"].setdefault(k, set()).add(page_id)
+
+def index_page(db_id, page):
+    # страницы, которые бот сам создал/изменил, попадают в индекс без запроса
+    key = _dbk(db_id)
+    if key not in INDEXED_DBS or not page: return
+    with _index_lock: _index_put(TITLE_INDEX.setdefault(key, _new_index()), key, page)
+
+def forget_page(page_id):
+    with _index_lock:
+        for idx in TITLE_INDEX.values(): _index_drop(idx, page_id)
+
+def sync_title_index(db_id, full=False):
+    key = _dbk(db_id)
+    with _index_lock:
+        idx = TITLE_INDEX.setdefault(key, _new_index())
+        since = idx["synced_at"]
+    full = full or not since or time.time() - idx["full_ts"] >= INDEX_FULL_RESYNC_SEC
+    synced_at = sync_mark()
+    kw = {} if full else {"filter": {"timestamp":"last_edited_time","last_edited_time":{"on_or_after": since}}}
+    pages = list(query_all(INDEXED_DBS[key][0], **kw))
+    with _index_lock:
+        if full:
+            idx = _new_index(); idx["full_ts"] = time.time()
+            TITLE_INDEX[key] = idx
+        for pg in pages: _index_put(idx, key, pg)
+        idx["synced_at"] = synced_at
+
+def lookup_title(db_id, name):
+    # None — индекс ещё не прогрет; иначе список id: точное совпадение -> подстрока -> нечёткое
+    q = _norm(name)
+    with _index_lock:
+        idx = TITLE_INDEX.get(_dbk(db_id))
+        if not idx or not idx["synced_at"] or not q: return None
+        keys = idx["keys"]
+        if q in keys: return sorted(keys[q])
+        sub = {i for k, ids in keys.items() if q in k for i in ids}
+        if sub: return sorted(sub)
+        close = difflib.get_close_matches(q, list(keys), n=3, cutoff=FUZZY_CUTOFF)
+        if len(close) > 1:
+            r0, r1 = (difflib.SequenceMatcher(None, q, k).ratio() for k in close[:2])
+            if r0 - r1 >= 0.1: close = close[:1]
+        return sorted({i for k in close for i in keys[k]})
+
+def _remote_matches(db_id, name):
+    # запасной путь без индекса: contains по заголовку, затем по доп. полю
+    _, title_prop, alt_prop = INDEXED_DBS[_dbk(db_id)]
+    found = {}
+    for prop, kind in ((title_prop, "title"), (alt_prop, "rich_text")):
+        if not prop: continue
+        resp = notion.databases.query(database_id=db_id, filter={"property": prop, kind: {"contains": name}}, page_size=5)
+        for r in resp.get("results", []):
+            p = r.get("properties", {})
+            found[r["id"]] = (rt_to_str(p.get(title_prop,{}).get("title",[])),
+                              rt_to_str(p.get(alt_prop,{}).get("rich_text",[])) if alt_prop else "")
+        if found: break
+    exact = [i for i, (t, a) in found.items() if _norm(name) in (_norm(t), _norm(a))]
+    return exact or list(found), found
+
+def resolve_page(db_id, name):
+    # -> (page_id, None) или (None, "not found" / "ambiguous: ...")
+    if not _norm(name): return None, "no name"   # contains "" совпал бы с любой страницей
+    ids = lookup_title(db_id, name)
+    if ids == []:   # промах по тёплому индексу — вдруг страницу только что создали в Notion
+        try: sync_title_index(db_id); ids = lookup_title(db_id, name)
+        except Exception as e: report_error("index sync", e)
+    if ids is None:
+        try: ids, titles = _remote_matches(db_id, name)
+        except Exception as e: report_error("find", e); return None, "not found"
+    else:
+        with _index_lock: titles = dict(TITLE_INDEX[_dbk(db_id)]["pages"])
+    if not ids: return None, "not found"
+    if len(ids) > 1:
+        names = [" @ ".join(x for x in titles.get(i, ("?", "")) if x) for i in ids[:5]]
+        return None, "ambiguous: " + " | ".join(names)
+    return ids[0], None
+
+def run_index_sync_loop():
+    while True:
+        beat("index-sync")
+        for key in list(INDEXED_DBS):
+            try: sync_title_index(INDEXED_DBS[key][0])
+            except Exception as e: report_error(f"index sync {key}", e)
+        if NOTION_HABITS_DB:
+            try: sync_habits()
+            except Exception as e: report_error("habits sync", e)
+        time.sleep(INDEX_REFRESH_SEC)
 
 # ---------- CRUD (Notion)
 
@@ -294,20 +1572,11 @@ def todo_add(name, due=None, priority=None, tags=None, notes=None):
 
 def todo_done(name):
     if not NOTION_TODO_DB: return "todo db not set"
-    page = find_by_title(NOTION_TODO_DB, name)
-    if not page: return "not found"
-    update_page(page["id"], {"Status":{"select":{"name":"Done"}}}); return "todo done"
+    page_id, err = resolve_page(NOTION_TODO_DB, name)
+    if err: return err
+    update_page(page_id, {"Status":{"select":{"name":"Done"}}}); return "todo done"
 
-def todo_list():
-    if not NOTION_TODO_DB: return "todo db not set"
-    resp = notion.databases.query(database_id=NOTION_TODO_DB, page_size=20)
-    items=[]
-    for r in resp.get("results",[]):
-        p=r["properties"]; title=rt_to_str(p["Title"]["title"])
-        st=p.get("Status",{}).get("select",{}).get("name","")
-        due=p.get("Due",{}).get("date",{}).get("start","")
-        items.append(f"- {title} [{st}] {('→ '+due) if due else ''}")
-    return "\n".join(items) or "empty"
+def todo_list(args=""): return list_text("todo", args)
 
 # Projects
 def project_add(name, due=None, notes=None, status="Planned"):
@@ -320,15 +1589,39 @@ def project_add(name, due=None, notes=None, status="Planned"):
 
 def project_status(name, status):
     if not NOTION_PROJECTS_DB: return "projects db not set"
-    page = find_by_title(NOTION_PROJECTS_DB, name)
-    if not page: return "not found"
-    update_page(page["id"], {"Status":{"select":{"name": status}}}); return "project updated"
+    page_id, err = resolve_page(NOTION_PROJECTS_DB, name)
+    if err: return err
+    update_page(page_id, {"Status":{"select":{"name": status}}}); return "project updated"
 
 def project_note(name, note):
     if not NOTION_PROJECTS_DB: return "projects db not set"
-    page = find_by_title(NOTION_PROJECTS_DB, name)
-    if not page: return "not found"
-    update_page(page["id"], {"Notes":{"rich_text":[{"text":{"content": note}}]}}); return "note saved"
+    page_id, err = resolve_page(NOTION_PROJECTS_DB, name)
+    if err: return err
+    update_page(page_id, {"Notes":{"rich_text":[{"text":{"content": note}}]}}); return "note saved"
+
+# Website
+def website_add_page(title, content=None, url=None):
+    if not NOTION_WEBSITE_DB: return "website db not set"
+    props = {"Title":{"title":[{"text":{"content": title[:NOTION_TEXT_MAX]}}]}}
+    if url: props["URL"] = {"url": url}
+    blocks = text_blocks(content)
+    # первые 100 блоков уходят вместе со страницей, остальное — пачками
+    page = create_page(NOTION_WEBSITE_DB, props, blocks[:NOTION_BLOCKS_MAX])
+    try: append_blocks(page["id"], blocks[NOTION_BLOCKS_MAX:])
+    except Exception:
+        # недописанную страницу убираем: повтор команды создаст её заново, а не рядом с обрубком
+        try: notion.pages.update(page_id=page["id"], archived=True); forget_page(page["id"])
+        except Exception as e: report_error("website cleanup", e)
+        raise
+    return f"page added ({len(blocks)} blocks)"
+
+def website_append(title, content=None):
+    if not NOTION_WEBSITE_DB: return "website db not set"
+    if not q_str(title): return "no page name"
+    if not q_str(content): return "no content"
+    page_id, err = resolve_page(NOTION_WEBSITE_DB, title)
+    if err: return err
+    return f"appended {append_blocks(page_id, text_blocks(content))} blocks"
 
 # Budget
 def budget_add(kind, amount, category=None, dt=None, notes=None):
@@ -339,30 +1632,77 @@ def budget_add(kind, amount, category=None, dt=None, notes=None):
     if category: props["Category"]={"rich_text":[{"text":{"content": category}}]}
     if dt: props["Date"]={"date":{"start": dt}}
     if notes: props["Notes"]={"rich_text":[{"text":{"content": notes}}]}
-    create_page(NOTION_BUDGET_DB, props); return f"{kind} added"
+    create_page(NOTION_BUDGET_DB, props); invalidate_budget_month(dt); return f"{kind} added"
+
+BUDGET_CLOSED_TTL_SEC = int(env("BUDGET_CLOSED_TTL_SEC", "86400"))
+BUDGET_MAX_MONTHS = int(env("BUDGET_MAX_MONTHS", "24"))
+BUDGET_MONTHS = {}   # (y, m) -> (ts, totals); только закрытые месяцы
+_budget_lock = Lock()
+
+def parse_month_range(spec):
+    # "2025-08" или "2025-06..2025-08" -> [(y, m), ...]
+    a, _, b = spec.partition("..")
+    (y, m), (y2, m2) = (tuple(map(int, x.strip().split("-"))) for x in (a, b or a))
+    if not (1 <= m <= 12 and 1 <= m2 <= 12): raise ValueError(f"bad month: {spec}")
+    months = []
+    while (y, m) <= (y2, m2):
+        months.append((y, m))
+        if len(months) > BUDGET_MAX_MONTHS: raise ValueError(f"range longer than {BUDGET_MAX_MONTHS} months")
+        y, m = (y, m+1) if m < 12 else (y+1, 1)
+    if not months: raise ValueError(f"empty range: {spec}")
+    return months
+
+def month_totals(y, m):
+    # потоково суммирует все страницы месяца; закрытые месяцы запоминаются
+    closed = (y, m) < (datetime.now(seoul_tz).year, datetime.now(seoul_tz).month)
+    if closed:
+        with _budget_lock: hit = BUDGET_MONTHS.get((y, m))
+        if hit and time.time() - hit[0] < BUDGET_CLOSED_TTL_SEC: return hit[1]
+    start=f"{y:04d}-{m:02d}-01"
+    m2, y2 = (m+1, y) if m<12 else (1, y+1)
+    end=f"{y2:04d}-{m2:02d}-01"
+    tot = {"income": 0.0, "expense": 0.0, "cats": {}}
+    for r in query_all(NOTION_BUDGET_DB, filter={"and":[
+        {"property":"Date","date":{"on_or_after": start}},
+        {"property":"Date","date":{"before": end}}
+    ]}):
+        p=r["properties"]; t=p.get("Type",{}).get("select",{}).get("name","")
+        if t not in ("income", "expense"): continue
+        amt=p.get("Amount",{}).get("number",0) or 0
+        cat=rt_to_str(p.get("Category",{}).get("rich_text",[])).strip() or "—"
+        tot[t]+=amt
+        tot["cats"][(t, cat)] = tot["cats"].get((t, cat), 0.0) + amt
+    if closed:
+        with _budget_lock: BUDGET_MONTHS[(y, m)] = (time.time(), tot)
+    return tot
+
+def invalidate_budget_month(dt):
+    if not dt: return   # без даты запись не попадает ни в один месяц
+    try: d = date.fromisoformat(dt[:10]); ym = (d.year, d.month)
+    except ValueError:
+        m = re.match(r"(\d{4})\D(\d{1,2})(?!\d)", dt.strip())   # 2026-3-5, 2026/03/05
+        ym = (int(m.group(1)), int(m.group(2))) if m else None
+    with _budget_lock:
+        if ym: BUDGET_MONTHS.pop(ym, None); return
+        BUDGET_MONTHS.clear()   # месяц не понять — сбрасываем весь кэш, а не оставляем устаревший
+    report_error("budget cache", ValueError(f"unparsed date {dt!r}: month cache cleared"))
 
 def budget_summary(month_ym):
     if not NOTION_BUDGET_DB: return "budget db not set"
     try:
-        y, m = map(int, month_ym.split("-"))
-        start=f"{y:04d}-{m:02d}-01"
-        m2, y2 = (m+1, y) if m<12 else (1, y+1)
-        end=f"{y2:04d}-{m2:02d}-01"
-        resp = notion.databases.query(
-            database_id=NOTION_BUDGET_DB,
-            filter={"and":[
-                {"property":"Date","date":{"on_or_after": start}},
-                {"property":"Date","date":{"before": end}}
-            ]},
-            page_size=200
-        )
-        income = expense = 0.0
-        for r in resp.get("results",[]):
-            p=r["properties"]; t=p.get("Type",{}).get("select",{}).get("name","")
-            amt=p.get("Amount",{}).get("number",0) or 0
-            if t=="income": income+=amt
-            elif t=="expense": expense+=amt
-        return f"{month_ym}\nДоход: {income:.2f}\nРасход: {expense:.2f}\nБаланс: {income-expense:.2f}"
+        months = parse_month_range(month_ym)
+        income = expense = 0.0; cats = {}; lines = []
+        for y, m in months:
+            t = month_totals(y, m)
+            income += t["income"]; expense += t["expense"]
+            for k, v in t["cats"].items(): cats[k] = cats.get(k, 0.0) + v
+            if len(months) > 1: lines.append(f"{y:04d}-{m:02d}: +{t['income']:.2f} / -{t['expense']:.2f}")
+        title = month_ym if len(months) == 1 else f"{months[0][0]:04d}-{months[0][1]:02d} — {months[-1][0]:04d}-{months[-1][1]:02d}"
+        out = [title] + lines + [f"Доход: {income:.2f}", f"Расход: {expense:.2f}", f"Баланс: {income-expense:.2f}"]
+        for kind, label in (("expense", "Расходы по категориям:"), ("income", "Доходы по категориям:")):
+            rows = sorted(((c, v) for (k, c), v in cats.items() if k == kind), key=lambda x: -x[1])
+            if rows: out += ["", label] + [f"- {c}: {v:.2f}" for c, v in rows]
+        return "\n".join(out)
     except Exception as e:
         return f"error: {e}"
 
@@ -379,30 +1719,11 @@ def job_add(role, company=None, link=None, stage="Applied", notes=None):
 
 def job_stage(role_or_company, stage):
     if not NOTION_JOBS_DB: return "jobs db not set"
-    page = find_by_title(NOTION_JOBS_DB, role_or_company)
-    if not page:
-        try:
-            resp = notion.databases.query(
-                database_id=NOTION_JOBS_DB,
-                filter={"property":"Company","rich_text":{"contains": role_or_company}},
-                page_size=1
-            )
-            page = (resp.get("results",[]) or [None])[0]
-        except Exception:
-            page=None
-    if not page: return "not found"
-    update_page(page["id"], {"Stage":{"select":{"name": stage}}}); return "job updated"
+    page_id, err = resolve_page(NOTION_JOBS_DB, role_or_company)
+    if err: return err
+    update_page(page_id, {"Stage":{"select":{"name": stage}}}); return "job updated"
 
-def job_list():
-    if not NOTION_JOBS_DB: return "jobs db not set"
-    resp = notion.databases.query(database_id=NOTION_JOBS_DB, page_size=50)
-    rows=[]
-    for r in resp.get("results",[]):
-        p=r["properties"]; role=rt_to_str(p["Role"]["title"])
-        comp=rt_to_str(p.get("Company",{}).get("rich_text",[]))
-        st=p.get("Stage",{}).get("select",{}).get("name","")
-        rows.append(f"- {role} @ {comp or '—'} [{st}]")
-    return "\n".join(rows) or "empty"
+def job_list(args=""): return list_text("jobs", args)
 
 # Inspiration
 def inspo_add(text=None, url=None, category=None, tags=None):
@@ -415,57 +1736,262 @@ def inspo_add(text=None, url=None, category=None, tags=None):
     if text: props["Notes"]={"rich_text":[{"text":{"content": text}}]}
     create_page(NOTION_INSPO_DB, props); return "inspo added"
 
-def inspo_list():
-    if not NOTION_INSPO_DB: return "inspo db not set"
-    resp = notion.databases.query(database_id=NOTION_INSPO_DB, page_size=20)
-    out=[]
-    for r in resp.get("results",[]):
-        p=r["properties"]; title=rt_to_str(p["Title"]["title"]); url=p.get("URL",{}).get("url","")
-        out.append(f"- {title} {('→ '+url) if url else ''}")
-    return "\n".join(out) or "empty"
+def inspo_list(args=""): return list_text("inspo", args)
+
+# ---------- list views (фильтр и сортировка — в запросе Notion, страницы — по next_cursor)
+LIST_PAGE_SIZE = int(env("LIST_PAGE_SIZE", "10"))
+LIST_VIEW_TTL_SEC = int(env("LIST_VIEW_TTL_SEC", "3600"))
+LIST_VIEWS_MAX = int(env("LIST_VIEWS_MAX", "64"))
+JOB_CLOSED_STAGES = [x.strip() for x in env("JOB_CLOSED_STAGES", "Rejected,Withdrawn,Closed").split(",") if x.strip()]
+
+def _sel(p, k): return ((p.get(k) or {}).get("select") or {}).get("name", "")
+def _date(p, k): return ((p.get(k) or {}).get("date") or {}).get("start", "")
+
+def _todo_row(p):
+    due, pr = _date(p, "Due"), _sel(p, "Priority")
+    return f"- {rt_to_str(p['Title']['title'])} [{_sel(p, 'Status')}]{' !'+pr if pr else ''} {('→ '+due) if due else ''}"
+
+def _job_row(p):
+    return f"- {rt_to_str(p['Role']['title'])} @ {rt_to_str(p.get('Company',{}).get('rich_text',[])) or '—'} [{_sel(p, 'Stage')}]"
+
+def _inspo_row(p):
+    url = (p.get("URL") or {}).get("url") or ""
+    return f"- {rt_to_str(p['Title']['title'])} {('→ '+url) if url else ''}"
+
+NEWEST = [{"timestamp":"created_time","direction":"descending"}]
+LIST_KINDS = {   # kind -> база, строка, фильтры, сортировки, (фильтр, сортировка) по умолчанию, строк без кнопок
+    "todo": {"db": NOTION_TODO_DB, "row": _todo_row, "default": ("open", "due"), "limit": 20,
+             "filters": {"open": {"property":"Status","select":{"does_not_equal":"Done"}},
+                         "done": {"property":"Status","select":{"equals":"Done"}}, "all": None},
+             "sorts": {"due": [{"property":"Due","direction":"ascending"}] + NEWEST,
+                       "priority": [{"property":"Priority","direction":"ascending"}, {"property":"Due","direction":"ascending"}],
+                       "new": NEWEST}},
+    "jobs": {"db": NOTION_JOBS_DB, "row": _job_row, "default": ("active", "new"), "limit": 50,
+             "filters": {"active": {"and": [{"property":"Stage","select":{"does_not_equal": s}} for s in JOB_CLOSED_STAGES]} if JOB_CLOSED_STAGES else None,
+                         "all": None},
+             "sorts": {"new": NEWEST, "stage": [{"property":"Stage","direction":"ascending"}] + NEWEST,
+                       "applied": [{"property":"Applied","direction":"descending"}]}},
+    "inspo": {"db": NOTION_INSPO_DB, "row": _inspo_row, "default": ("all", "new"), "limit": 20,
+              "filters": {"all": None}, "sorts": {"new": NEWEST, "old": [{"timestamp":"created_time","direction":"ascending"}]}},
+}
+LIST_VIEWS = OrderedDict()   # view id -> {kind, flt, sort, cursors: [None, cursor стр. 2, ...], ts}
+_views_lock = Lock()
+
+def parse_list_args(kind, text):
+    # «/todo_list all priority» — слова сверяются с именами фильтров и сортировок
+    spec = LIST_KINDS[kind]; flt, sort = spec["default"]
+    for w in (text or "").lower().split():
+        if w in spec["filters"]: flt = w
+        elif w in spec["sorts"]: sort = w
+    return flt, sort
+
+def _list_view(kind, flt, sort, view_id, page):
+    # -> (view, view_id, cursor) или None, если view устарел; первая страница заводит view
+    spec = LIST_KINDS[kind]
+    with _views_lock:
+        if view_id:
+            v = LIST_VIEWS.get(view_id)
+            if not v or time.time() - v["ts"] > LIST_VIEW_TTL_SEC or not 0 <= page < len(v["cursors"]): return None
+            LIST_VIEWS.move_to_end(view_id)
+        else:
+            view_id = uuid.uuid4().hex[:10]
+            v = LIST_VIEWS[view_id] = {"kind": kind, "flt": flt or spec["default"][0], "sort": sort or spec["default"][1], "cursors": [None]}
+            while len(LIST_VIEWS) > LIST_VIEWS_MAX: LIST_VIEWS.popitem(last=False)
+        v["ts"] = time.time()
+        return v, view_id, v["cursors"][page]
+
+def list_page(kind, flt=None, sort=None, view_id=None, page=0):
+    # следующие страницы продолжают с сохранённого next_cursor, а не с начала выборки
+    spec = LIST_KINDS[kind]
+    if not spec["db"]: return {"text": f"{kind} db not set", "view": None, "page": 0, "prev": False, "next": False}
+    found = _list_view(kind, flt, sort, view_id, page)
+    if not found: return None
+    v, view_id, cursor = found
+    resp = _list_query(spec, v, cursor, LIST_PAGE_SIZE)
+    more = bool(resp.get("has_more") and resp.get("next_cursor"))
+    if more:
+        with _views_lock:
+            if len(v["cursors"]) == page + 1: v["cursors"].append(resp["next_cursor"])
+    rows = [spec["row"](r["properties"]) for r in resp.get("results", [])]
+    head = f"{kind}: {v['flt']}, {v['sort']}" + (f" — стр. {page + 1}" if page or more else "")
+    return {"text": head + "\n" + ("\n".join(rows) or "empty"), "view": view_id, "page": page, "prev": page > 0, "next": more}
+
+def _list_query(spec, v, cursor, page_size):
+    kw = {"filter": spec["filters"][v["flt"]]} if spec["filters"][v["flt"]] else {}
+    return notion.databases.query(database_id=spec["db"], start_cursor=cursor, page_size=page_size,
+                                  sorts=spec["sorts"][v["sort"]], **kw)
+
+def list_text(kind, args=""):
+    # команды из Notion: листать там нечем — одна страница на spec["limit"] строк и без view
+    spec = LIST_KINDS[kind]
+    if not spec["db"]: return f"{kind} db not set"
+    flt, sort = parse_list_args(kind, args)
+    resp = _list_query(spec, {"flt": flt, "sort": sort}, None, spec["limit"])
+    rows = [spec["row"](r["properties"]) for r in resp.get("results", [])]
+    if resp.get("has_more"): rows.append(f"… больше {spec['limit']}, остальное — /{kind if kind != 'jobs' else 'job'}_list в Telegram")
+    return f"{kind}: {flt}, {sort}\n" + ("\n".join(rows) or "empty")
+
+def list_keyboard(pg):
+    if not pg or not (pg["prev"] or pg["next"]): return None
+    row = []
+    if pg["prev"]: row.append(InlineKeyboardButton("« назад", callback_data=f"lv:{pg['view']}:{pg['page'] - 1}"))
+    if pg["next"]: row.append(InlineKeyboardButton("дальше »", callback_data=f"lv:{pg['view']}:{pg['page'] + 1}"))
+    return InlineKeyboardMarkup([row])
 
 # Habits
+HABITS = {"names": {}, "days": {}, "pages": {}, "synced_at": None, "full_ts": 0}
+# names: key -> отображаемое имя; days: key -> {ordinal: число отметок}; pages: page_id -> (key, ordinal)
+_habits_lock = Lock()
+
+def today_local(): return datetime.now(seoul_tz).date()
+
+def _habit_apply(store, page):
+    old = store["pages"].pop(page["id"], None)
+    if old:
+        marks = store["days"].get(old[0], {})
+        marks[old[1]] = marks.get(old[1], 1) - 1
+        if marks[old[1]] <= 0: del marks[old[1]]
+    if page.get("archived") or page.get("in_trash"): return
+    p = page.get("properties", {})
+    name = rt_to_str(p.get("Habit",{}).get("title",[])).strip()
+    if not name: return
+    key = _norm(name)
+    store["names"].setdefault(key, name)
+    store["days"].setdefault(key, {})
+    start = (p.get("Date",{}).get("date") or {}).get("start")
+    if start and p.get("Done",{}).get("checkbox"):
+        o = date.fromisoformat(start[:10]).toordinal()
+        store["pages"][page["id"]] = (key, o)
+        store["days"][key][o] = store["days"][key].get(o, 0) + 1
+
+def sync_habits(full=False):
+    global HABITS
+    with _habits_lock: since, full_ts = HABITS["synced_at"], HABITS["full_ts"]
+    full = full or not since or time.time() - full_ts >= INDEX_FULL_RESYNC_SEC
+    synced_at = sync_mark()
+    kw = {} if full else {"filter": {"timestamp":"last_edited_time","last_edited_time":{"on_or_after": since}}}
+    pages = list(query_all(NOTION_HABITS_DB, **kw))
+    with _habits_lock:
+        if full: HABITS = {"names": {}, "days": {}, "pages": {}, "synced_at": None, "full_ts": time.time()}
+        for pg in pages: _habit_apply(HABITS, pg)
+        HABITS["synced_at"] = synced_at
+
+def _habits_ready():
+    if not HABITS["synced_at"]: sync_habits(full=True)
+
+def habit_stats(marks, today, days):
+    # -> (отмечено за окно, текущая серия, лучшая серия)
+    t = today.toordinal()
+    window = sum(1 for o in range(t - days + 1, t + 1) if o in marks)
+    streak, o = 0, (t if t in marks else t - 1)   # сегодня ещё можно успеть — серия не рвётся
+    while o in marks: streak += 1; o -= 1
+    best = run = 0; prev = None
+    for o in sorted(marks):
+        run = run + 1 if prev == o - 1 else 1
+        best, prev = max(best, run), o
+    return window, streak, best
+
 def habit_add(name):
     if not NOTION_HABITS_DB: return "habits db not set"
-    create_page(NOTION_HABITS_DB, {"Habit":{"title":[{"text":{"content": name}}]}})
+    page = create_page(NOTION_HABITS_DB, {"Habit":{"title":[{"text":{"content": name}}]}})
+    with _habits_lock: _habit_apply(HABITS, page)
     return "habit added"
 
 def habit_mark(name, dt=None, done=True, notes=None):
     if not NOTION_HABITS_DB: return "habits db not set"
     props={"Habit":{"title":[{"text":{"content": name}}]},
-           "Date":{"date":{"start": (dt or date.today().isoformat())}},
+           "Date":{"date":{"start": (dt or today_local().isoformat())}},
            "Done":{"checkbox": bool(done)}}
     if notes: props["Notes"]={"rich_text":[{"text":{"content": notes}}]}
-    create_page(NOTION_HABITS_DB, props); return "habit marked"
+    page = create_page(NOTION_HABITS_DB, props)
+    with _habits_lock: _habit_apply(HABITS, page)
+    return "habit marked"
 
 def habit_today():
     if not NOTION_HABITS_DB: return "habits db not set"
-    today=date.today().isoformat()
-    resp=notion.databases.query(
-        database_id=NOTION_HABITS_DB,
-        filter={"property":"Date","date":{"equals": today}},
-        page_size=50
-    )
-    return f"Сегодня отмечено {len(resp.get('results',[]))} привычек."
+    _habits_ready()
+    today = today_local(); t = today.toordinal()
+    with _habits_lock:
+        rows = [(HABITS["names"][k], t in m, habit_stats(m, today, 1)[1]) for k, m in HABITS["days"].items()]
+    done = sum(1 for _, d, _ in rows if d)
+    lines = [f"{'✅' if d else '⬜️'} {n} — серия {st}" for n, d, st in sorted(rows, key=lambda r: (not r[1], r[0].casefold()))]
+    return "\n".join([f"Сегодня отмечено {done} из {len(rows)} привычек."] + lines)
 
 def habit_summary(days=7):
     if not NOTION_HABITS_DB: return "habits db not set"
-    resp=notion.databases.query(database_id=NOTION_HABITS_DB, page_size=100)
-    return f"Зафиксировано записей: {len(resp.get('results',[]))}"
+    _habits_ready()
+    today = today_local()
+    with _habits_lock:
+        rows = [(HABITS["names"][k], habit_stats(m, today, days)) for k, m in HABITS["days"].items()]
+    if not rows: return "Привычек пока нет."
+    out = [f"Привычки за {days} дн.:"]
+    for n, (win, streak, best) in sorted(rows, key=lambda r: (-r[1][0], r[0].casefold())):
+        out.append(f"- {n}: {win}/{days} ({win*100//days}%), серия {streak}, лучшая {best}")
+    return "\n".join(out)
 
 # ---------- Bot Commands (DB commands)
+COMMAND_WORKERS = int(env("COMMAND_WORKERS", "4"))
+COMMAND_CLAIM_TTL_SEC = int(env("COMMAND_CLAIM_TTL_SEC", "600"))
+# меняют общее состояние или порядок сообщений — выполняются строго по очереди
+SERIAL_COMMANDS = {"send", "pause", "resume", "set_city", "add_schedule", "list_schedule", "reload_schedule"}
+COMMAND_POOL = ThreadPoolExecutor(max_workers=COMMAND_WORKERS, thread_name_prefix="cmd")
+SERIAL_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cmd-serial")
+_cmd_lock = Lock()
+_cmd_inflight = set()
+_cmd_results = OrderedDict()   # page_id -> результат для повторной записи статуса (последние 256)
+
 def fetch_pending_commands():
     if not (notion and NOTION_COMMANDS_DB): return []
+    # Pending + «In progress», чей захват протух (процесс упал посреди команды)
+    stale = (datetime.now(pytz.utc) - timedelta(seconds=COMMAND_CLAIM_TTL_SEC)).isoformat()
     try:
         resp = notion.databases.query(
             database_id=NOTION_COMMANDS_DB,
-            filter={"property":"Status","select":{"equals":"Pending"}},
+            filter={"or":[
+                {"property":"Status","select":{"equals":"Pending"}},
+                {"and":[
+                    {"property":"Status","select":{"equals":"In progress"}},
+                    {"timestamp":"last_edited_time","last_edited_time":{"before": stale}}
+                ]}
+            ]},
+            sorts=[{"timestamp":"created_time","direction":"ascending"}],
             page_size=50
         )
         return resp.get("results",[])
     except Exception:
+        report_error("fetch commands")
         return []
 
+def _command_key(pg):
+    # версия страницы: протухший «In progress» имеет новый last_edited_time и захватывается заново
+    return f"{pg['id']}@{pg.get('last_edited_time', '')}"
+
+def claim_command(pg):
+    # атомарно через журнал срабатываний: два опроса (webhook и цикл, или два процесса), получившие одну
+    # и ту же версию страницы, не выполнят её дважды. «In progress» в Notion — для подбора протухших
+    key = _command_key(pg)
+    if not LEDGER.claim("command", key, INSTANCE_ID): return False
+    try:
+        notion.pages.update(page_id=pg["id"], properties={"Status":{"select":{"name":"In progress"}}})
+        return True
+    except Exception as e:
+        LEDGER.release("command", key, INSTANCE_ID)
+        report_error("claim_command", e)
+        return False
+
+def command_name(pg):
+    return pg.get("properties",{}).get("Command",{}).get("select",{}).get("name","")
+
+def _run_claimed(pg):
+    try:
+        if claim_command(pg):
+            # уже выполнена, но статус в Notion не записался — повторяем только запись статуса
+            if LEDGER.is_done("command", pg["id"]): update_command_status(pg["id"], _cmd_results.get(pg["id"], "done"))
+            else: exec_command(pg)
+            LEDGER.done("command", _command_key(pg))
+    finally:
+        with _cmd_lock: _cmd_inflight.discard(pg["id"])
+
 def update_command_status(page_id, result_text="done"):
     if not notion: return
     try:
@@ -473,17 +1999,18 @@ def update_command_status(page_id, result_text="done"):
             page_id=page_id,
             properties={
                 "Status":{"select":{"name":"Done"}},
-                "Result":{"rich_text":[{"text":{"content": result_text}}]}
+                "Result":{"rich_text": rich_text(str(result_text))}
             }
         )
     except Exception:
-        pass
+        report_error("command status")
 
+@timed("exec_command")
 def exec_command(pg):
     global PAUSED, current_city
     p = pg.get("properties", {})
 
-    cmd  = p.get("Command",{}).get("select",{}).get("name","")
+    cmd  = command_name(pg)
     text = rt_to_str(p.get("Text",{}).get("rich_text",[]))
     city = rt_to_str(p.get("City",{}).get("rich_text",[]))
     category = rt_to_str(p.get("Category",{}).get("rich_text",[]))
@@ -508,12 +2035,13 @@ def exec_command(pg):
     result = "ok"
     try:
         if cmd == "send":
-            result = "no text" if not q_str(text) else (safe_send(text) or "sent")
+            result = "no text" if not q_str(text) else ("sent" if safe_send(text) else "send failed")
 
         elif cmd == "pause":   PAUSED=True;  result="paused"
         elif cmd == "resume":  PAUSED=False; result="resumed"
         elif cmd == "set_city":
             current_city = q_str(city) or current_city
+            set_subscriber(CHAT_ID, city=current_city)
             safe_send(f"Город для погоды: {current_city}")
             result = f"city={current_city}"
 
@@ -524,7 +2052,7 @@ def exec_command(pg):
                     "Title":{"title":[{"text":{"content": category or "template"}}]},
                     "Category":{"rich_text":[{"text":{"content": category or ''}}]},
                     "Text":{"rich_text":[{"text":{"content": text or ''}}]}
-                }); result="template added"
+                }); invalidate_templates(category or None); result="template added"
 
         elif cmd == "add_schedule":
             if not NOTION_SCHEDULE_DB: result="schedule db not set"
@@ -541,8 +2069,10 @@ def exec_command(pg):
                 }); reload_schedule(force=True); result="schedule added"
 
         elif cmd == "list_schedule":
-            rows = fetch_schedule_rows()
+            reload_schedule(force=True)
+            rows, errors = sorted(SCHEDULE_CACHE, key=lambda r: r["time"]), SCHEDULE_ERRORS
             summary = "\n".join([f"- {r['time']} | {r['type']} | {','.join(r.get('days') or []) or 'daily'} | {r['title']}" for r in rows]) or "no active"
+            if errors: summary += "\n\nНе будут срабатывать:\n" + "\n".join(f"- {x}" for x in errors)
             safe_send("Текущее расписание из Notion:\n"+summary)
             result="listed"
 
@@ -551,7 +2081,7 @@ def exec_command(pg):
         # To-Do
         elif cmd == "todo_add":    result = todo_add(name, due=due, priority=priority, tags=tags, notes=notes)
         elif cmd == "todo_done":   result = todo_done(name)
-        elif cmd == "todo_list":   safe_send(todo_list()); result="listed"
+        elif cmd == "todo_list":   safe_send(todo_list(text)); result="listed"
 
         # Projects
         elif cmd == "project_add":     result = project_add(name, due=due, notes=notes)
@@ -566,17 +2096,17 @@ def exec_command(pg):
         # Jobs
         elif cmd == "job_add":    result = job_add(name or "Role", company=company, link=url, stage=stage or "Applied", notes=notes or text)
         elif cmd == "job_stage":  result = job_stage(name or company, stage or q_str(text) or "Interview")
-        elif cmd == "job_list":   safe_send(job_list()); result="listed"
+        elif cmd == "job_list":   safe_send(job_list(text)); result="listed"
 
         # Inspiration
         elif cmd == "inspo_add":  result = inspo_add(text=text, url=url, category=category2, tags=tags)
-        elif cmd == "inspo_list": safe_send(inspo_list()); result="listed"
+        elif cmd == "inspo_list": safe_send(inspo_list(text)); result="listed"
 
         # Habits
         elif cmd == "habit_add":    result = habit_add(name)
         elif cmd == "habit_mark":   result = habit_mark(name, dt=date_any, done=True, notes=notes)
         elif cmd == "habit_today":  safe_send(habit_today()); result="listed"
-        elif cmd == "habit_summary": safe_send(habit_summary()); result="listed"
+        elif cmd == "habit_summary": safe_send(habit_summary(int(q_str(text)) if q_str(text).isdigit() and int(q_str(text)) > 0 else 7)); result="listed"
 
         # Website
         elif cmd == "website_add_page": result = website_add_page(name or "Post", content=text or notes, url=url)
@@ -585,34 +2115,190 @@ def exec_command(pg):
         else:
             result = f"unknown command: {cmd or '(empty)'}"
     except Exception as e:
-        print("exec_command error:", e)
+        report_error("exec_command", e)
         result = f"error: {e}"
 
+    status = "unknown" if str(result).startswith("unknown command") else "error" if str(result).startswith("error") else "ok"
+    inc("connor_commands_total", command=cmd if status != "unknown" else "?", status=status)
+    record_command_done(pg["id"], result)
     update_command_status(pg["id"], result)
 
+def record_command_done(page_id, result):
+    # в журнал до записи статуса: если запись статуса упадёт, протухший «In progress» не выполнится второй раз
+    try:
+        LEDGER.claim("command", page_id, INSTANCE_ID); LEDGER.done("command", page_id)
+    except Exception as e: report_error("command ledger", e)
+    with _cmd_lock:
+        _cmd_results[page_id] = str(result)
+        while len(_cmd_results) > 256: _cmd_results.popitem(last=False)
+
+@timed("poll_notion_commands")
 def poll_notion_commands():
+    futures = []
     for pg in fetch_pending_commands():
-        exec_command(pg)
+        with _cmd_lock:   # пересекающийся опрос не возьмёт команду, уже стоящую в очереди
+            if pg["id"] in _cmd_inflight: continue
+            _cmd_inflight.add(pg["id"])
+        pool = SERIAL_POOL if command_name(pg) in SERIAL_COMMANDS else COMMAND_POOL
+        futures.append(pool.submit(_run_claimed, pg))
+    for f in futures:
+        try: f.result()
+        except Exception as e: report_error("command", e)
+    return len(futures)
+
+# ---------- batch mode (по строке на запись)
+BATCH_WORKERS = int(env("BATCH_WORKERS", "4"))
+BATCH_MAX_LINES = int(env("BATCH_MAX_LINES", "50"))
+BATCH_POOL = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+
+def run_batch(lines, fn, ok):
+    # строки выполняются параллельно; ответ — один на всю пачку, в исходном порядке
+    if len(lines) > BATCH_MAX_LINES: return f"Слишком много строк: {len(lines)} (максимум {BATCH_MAX_LINES})."
+    def one(line):
+        try: return fn(line)
+        except Exception as e: return f"error: {e}"
+    results = list(BATCH_POOL.map(one, lines))
+    good = sum(1 for r in results if r == ok)
+    out = [f"Готово {good} из {len(lines)}:"]
+    for line, r in zip(lines, results):
+        out.append(f"{'✅' if r == ok else '❌'} {line[:60]}" + ("" if r == ok else f" — {r}"))
+    return "\n".join(out)
+
+def _todo_line(s):
+    name, kv = _parse_kv(s)
+    if not name: return "no name"
+    return todo_add(name, kv.get("due"), kv.get("priority"), kv.get("tags"), kv.get("notes"))
+
+def _job_line(s):
+    role, kv = _parse_kv(s)
+    return job_add(role or "Role", kv.get("company"), kv.get("url"), kv.get("stage") or "Applied", kv.get("notes"))
+
+def _budget_line(kind):
+    def line(s):
+        head, kv = _parse_kv(s)
+        return budget_add(kind, head, kv.get("cat"), kv.get("date"), kv.get("notes"))
+    return line
+
+# ---------- warm-start snapshot
+SNAPSHOT_PATH = env("SNAPSHOT_PATH", data_path("state_snapshot.json"))
+SNAPSHOT_EVERY_SEC = int(env("SNAPSHOT_EVERY_SEC", "60"))
+SNAPSHOT_VERSION = 1
+_snapshot_last = None
+
+def save_snapshot():
+    # производное состояние на диск; файл пишется, только если что-то поменялось
+    global _snapshot_last
+    with _tpl_lock:
+        templates = {k: {"pool": v["pool"], "ts": v["ts"]} for k, v in TEMPLATE_CACHE.items() if v["valid"]}
+    with _index_lock:
+        index = {k: {"pages": dict(v["pages"]), "synced_at": v["synced_at"], "full_ts": v["full_ts"]}
+                 for k, v in TITLE_INDEX.items() if v["synced_at"]}
+    with _habits_lock:
+        habits = {"names": dict(HABITS["names"]), "pages": dict(HABITS["pages"]),
+                  "synced_at": HABITS["synced_at"], "full_ts": HABITS["full_ts"]} if HABITS["synced_at"] else None
+    data = json.dumps({
+        "version": SNAPSHOT_VERSION, "paused": PAUSED, "city": current_city,
+        "schedule": {"rows": list(SCHEDULE_ROWS.values()), "synced_at": SCHEDULE_SYNCED_AT, "full_ts": SCHEDULE_FULL_SYNC_TS},
+        "templates": templates, "index": index, "habits": habits,
+    }, ensure_ascii=False)
+    if data == _snapshot_last: return
+    tmp = SNAPSHOT_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f: f.write(data)
+    os.replace(tmp, SNAPSHOT_PATH)
+    _snapshot_last = data
+
+def load_snapshot():
+    # на старте: поднять расписание/шаблоны/индексы с диска; сверка с Notion идёт дальше фоновыми циклами
+    global PAUSED, current_city, SCHEDULE_ROWS, SCHEDULE_CACHE, SCHEDULE_INDEX, SCHEDULE_ERRORS
+    global SCHEDULE_SYNCED_AT, SCHEDULE_FULL_SYNC_TS, SCHEDULE_CACHE_TS, HABITS
+    try:
+        with open(SNAPSHOT_PATH, encoding="utf-8") as f: data = json.load(f)
+    except FileNotFoundError: return False
+    except Exception as e: report_error("snapshot load", e); return False
+    if data.get("version") != SNAPSHOT_VERSION: return False
+
+    PAUSED = bool(data.get("paused")); current_city = data.get("city") or current_city
+    sch = data.get("schedule") or {}
+    rows = {r["id"]: r for r in sch.get("rows", [])}
+    index, errors = compile_schedule(list(rows.values()))
+    with _schedule_lock:
+        SCHEDULE_ROWS, SCHEDULE_CACHE, SCHEDULE_INDEX, SCHEDULE_ERRORS = rows, list(rows.values()), index, errors
+        SCHEDULE_SYNCED_AT, SCHEDULE_FULL_SYNC_TS, SCHEDULE_CACHE_TS = sch.get("synced_at"), sch.get("full_ts", 0), 0
+    schedule_changed()
+
+    with _tpl_lock:
+        for cat, v in (data.get("templates") or {}).items():
+            TEMPLATE_CACHE[cat] = {"pool": v["pool"], "ts": v["ts"], "valid": True}
+    with _index_lock:
+        for key, v in (data.get("index") or {}).items():
+            if key not in INDEXED_DBS: continue
+            idx = _new_index(); idx["synced_at"], idx["full_ts"] = v["synced_at"], v["full_ts"]
+            for page_id, (title, alt) in v["pages"].items(): _index_set(idx, page_id, title, alt)
+            TITLE_INDEX[key] = idx
+    h = data.get("habits")
+    if h and NOTION_HABITS_DB:
+        store = {"names": h["names"], "days": {k: {} for k in h["names"]}, "pages": {}, "synced_at": h["synced_at"], "full_ts": h["full_ts"]}
+        for page_id, (key, o) in h["pages"].items():
+            store["pages"][page_id] = (key, o)
+            marks = store["days"].setdefault(key, {})
+            marks[o] = marks.get(o, 0) + 1
+        with _habits_lock: HABITS = store
+    return True
+
+def run_snapshot_loop():
+    while True:
+        beat("snapshot")
+        time.sleep(SNAPSHOT_EVERY_SEC)
+        try: save_snapshot()
+        except Exception as e: report_error("snapshot save", e)
 
 # ---------- Telegram command handlers
 def run_telegram_bot():
-    updater = Updater(API_TOKEN, use_context=True)
+    from telegram.ext import Updater, CommandHandler, CallbackQueryHandler   # тяжёлый импорт — не на пути старта
+    updater = Updater(bot=bot.get(), use_context=True, workers=TG_WORKERS)
     dp = updater.dispatcher
 
+    def cmd_start(update, ctx): update.message.reply_text(subscribe(update.effective_chat.id))
+
     @only_me
-    def cmd_start(update, ctx): update.message.reply_text("Привет, Лиза. Я активен. /help — список команд.")
+    def cmd_invite(update, ctx):
+        # приглашённый появляется неактивным: рассылка начнётся после его /start
+        try: chat_id = int(args_text(ctx))
+        except ValueError: update.message.reply_text("Формат: /invite <chat_id>"); return
+        if chat_id in SUBSCRIBERS: update.message.reply_text("Уже в списке."); return
+        set_subscriber(chat_id, active=False)
+        update.message.reply_text(f"Пригласил {chat_id}: пусть напишет боту /start.")
+
+    @subscriber_only
+    def cmd_stop(update, ctx, sub): update.message.reply_text(unsubscribe(sub["chat_id"]))
+    @subscriber_only
+    def cmd_pause(update, ctx, sub): set_subscriber(sub["chat_id"], paused=True); update.message.reply_text("Пауза. /resume — продолжить.")
+    @subscriber_only
+    def cmd_resume(update, ctx, sub): set_subscriber(sub["chat_id"], paused=False); update.message.reply_text("Снова на связи.")
+
+    @subscriber_only
+    def cmd_settings(update, ctx, sub):
+        text = " ".join(ctx.args or [])
+        if not text:
+            update.message.reply_text(describe_subscriber(sub) + "\n\nПример: /settings tz=Europe/Berlin; city=Berlin; morning=07:30; day=off"); return
+        fields, errors = parse_settings(text, sub)
+        if errors: update.message.reply_text("\n".join(errors)); return
+        update.message.reply_text(describe_subscriber(set_subscriber(sub["chat_id"], **fields)))
     @only_me
     def cmd_help(update, ctx):
         update.message.reply_text(
             "Команды:\n"
             "/send <текст>\n/weather\n"
             "/todo_add <назв>; due=YYYY-MM-DD; priority=High; tags=a,b; notes=...\n"
-            "/todo_done <назв>\n/todo_list\n"
+            "/todo_done <назв>\n/todo_list [open|done|all] [due|priority|new]\n"
             "/job_add <роль>; company=...; url=https://...; stage=Applied\n"
-            "/job_list\n"
+            "/job_list [active|all] [new|stage|applied]\n/inspo_list [new|old]\n"
             "/budget_expense <сумма>; cat=...; date=YYYY-MM-DD\n"
             "/budget_income <сумма>; cat=...; date=YYYY-MM-DD\n"
-            "/schedule_reload"
+            "/schedule_reload\n"
+            "/settings, /pause, /resume, /stop — для каждого получателя\n"
+            "/invite <chat_id> — пустить получателя (без OPEN_SUBSCRIPTIONS=1 /start принимает только приглашённых)\n\n"
+            "todo_add, todo_done, job_add, budget_*: несколько строк — пакетом, по записи на строку."
         )
 
     @only_me
@@ -623,120 +2309,236 @@ def run_telegram_bot():
         if not t: update.message.reply_text("Пример: /send Доброе утро"); return
         safe_send(t); update.message.reply_text("Отправил.")
 
-    @only_me
-    def cmd_weather(update, ctx): send_weather(); update.message.reply_text("Запросил погоду.")
+    @subscriber_only
+    def cmd_weather(update, ctx, sub):
+        send_weather(chat_id=sub["chat_id"], city=sub["city"]); update.message.reply_text("Запросил погоду.")
 
     @only_me
     def cmd_todo_add(update, ctx):
-        s = args_text(ctx)
-        if not s: update.message.reply_text("Пример: /todo_add Закончить модуль; due=2025-08-10; priority=High"); return
-        name, kv = _parse_kv(s)
-        update.message.reply_text(todo_add(name, kv.get("due"), kv.get("priority"), kv.get("tags"), kv.get("notes")))
+        lines = args_lines(update)
+        if not lines: update.message.reply_text("Пример: /todo_add Закончить модуль; due=2025-08-10; priority=High"); return
+        reply_long(update, _todo_line(lines[0]) if len(lines) == 1 else run_batch(lines, _todo_line, "todo added"))
 
     @only_me
     def cmd_todo_done(update, ctx):
-        t = args_text(ctx)
-        if not t: update.message.reply_text("Пример: /todo_done Закончить модуль"); return
-        update.message.reply_text(todo_done(t))
+        lines = args_lines(update)
+        if not lines: update.message.reply_text("Пример: /todo_done Закончить модуль"); return
+        reply_long(update, todo_done(lines[0]) if len(lines) == 1 else run_batch(lines, todo_done, "todo done"))
+
+    def reply_list(update, ctx, kind):
+        pg = list_page(kind, *parse_list_args(kind, args_text(ctx)))
+        reply_long(update, pg["text"], list_keyboard(pg))
 
     @only_me
-    def cmd_todo_list(update, ctx): update.message.reply_text(todo_list())
+    def cmd_todo_list(update, ctx): reply_list(update, ctx, "todo")
 
     @only_me
     def cmd_job_add(update, ctx):
-        s = args_text(ctx)
-        if not s: update.message.reply_text("Пример: /job_add Digital Marketing Assistant; company=Transparent Hiring; url=https://...; stage=Applied"); return
-        role, kv = _parse_kv(s)
-        update.message.reply_text(job_add(role or "Role", kv.get("company"), kv.get("url"), kv.get("stage") or "Applied", kv.get("notes")))
+        lines = args_lines(update)
+        if not lines: update.message.reply_text("Пример: /job_add Digital Marketing Assistant; company=Transparent Hiring; url=https://...; stage=Applied"); return
+        reply_long(update, _job_line(lines[0]) if len(lines) == 1 else run_batch(lines, _job_line, "job added"))
 
     @only_me
-    def cmd_job_list(update, ctx): update.message.reply_text(job_list())
+    def cmd_job_list(update, ctx): reply_list(update, ctx, "jobs")
+    @only_me
+    def cmd_inspo_list(update, ctx): reply_list(update, ctx, "inspo")
+
+    @only_me
+    def on_list_page(update, ctx):
+        q = update.callback_query
+        _, view_id, page = q.data.split(":")
+        with _views_lock: kind = (LIST_VIEWS.get(view_id) or {}).get("kind")
+        pg = list_page(kind, view_id=view_id, page=int(page)) if kind else None
+        if not pg: q.answer("Список устарел — запросите заново."); return
+        q.answer()
+        q.edit_message_text(pg["text"], reply_markup=list_keyboard(pg))
 
     @only_me
     def cmd_budget_exp(update, ctx):
-        s = args_text(ctx)
-        if not s: update.message.reply_text("Пример: /budget_expense 12.5; cat=кофе; date=2025-08-10"); return
-        head, kv = _parse_kv(s)
-        update.message.reply_text(budget_add("expense", head, kv.get("cat"), kv.get("date"), kv.get("notes")))
+        lines = args_lines(update)
+        if not lines: update.message.reply_text("Пример: /budget_expense 12.5; cat=кофе; date=2025-08-10"); return
+        line = _budget_line("expense")
+        reply_long(update, line(lines[0]) if len(lines) == 1 else run_batch(lines, line, "expense added"))
 
     @only_me
     def cmd_budget_inc(update, ctx):
-        s = args_text(ctx)
-        if not s: update.message.reply_text("Пример: /budget_income 200; cat=фриланс; date=2025-08-10"); return
-        head, kv = _parse_kv(s)
-        update.message.reply_text(budget_add("income", head, kv.get("cat"), kv.get("date"), kv.get("notes")))
+        lines = args_lines(update)
+        if not lines: update.message.reply_text("Пример: /budget_income 200; cat=фриланс; date=2025-08-10"); return
+        line = _budget_line("income")
+        reply_long(update, line(lines[0]) if len(lines) == 1 else run_batch(lines, line, "income added"))
 
     @only_me
     def cmd_sched_reload(update, ctx): reload_schedule(force=True); update.message.reply_text("Расписание перечитано.")
 
-    dp.add_handler(CommandHandler("start", cmd_start))
-    dp.add_handler(CommandHandler("help",  cmd_help))
-    dp.add_handler(CommandHandler("status",cmd_status))
-    dp.add_handler(CommandHandler("send",  cmd_send))
-    dp.add_handler(CommandHandler("weather", cmd_weather))
-
-    dp.add_handler(CommandHandler("todo_add",  cmd_todo_add))
-    dp.add_handler(CommandHandler("todo_done", cmd_todo_done))
-    dp.add_handler(CommandHandler("todo_list", cmd_todo_list))
-
-    dp.add_handler(CommandHandler("job_add", cmd_job_add))
-    dp.add_handler(CommandHandler("job_list", cmd_job_list))
-
-    dp.add_handler(CommandHandler("budget_expense", cmd_budget_exp))
-    dp.add_handler(CommandHandler("budget_income",  cmd_budget_inc))
-
-    dp.add_handler(CommandHandler("schedule_reload", cmd_sched_reload))
-
+    # run_async: обработчик уходит в пул диспетчера, медленный Notion не держит очередь апдейтов
+    for name, fn in (
+        ("start", cmd_start), ("help", cmd_help), ("status", cmd_status),
+        ("invite", cmd_invite), ("stop", cmd_stop), ("pause", cmd_pause), ("resume", cmd_resume), ("settings", cmd_settings),
+        ("send", cmd_send), ("weather", cmd_weather),
+        ("todo_add", cmd_todo_add), ("todo_done", cmd_todo_done), ("todo_list", cmd_todo_list),
+        ("job_add", cmd_job_add), ("job_list", cmd_job_list), ("inspo_list", cmd_inspo_list),
+        ("budget_expense", cmd_budget_exp), ("budget_income", cmd_budget_inc),
+        ("schedule_reload", cmd_sched_reload),
+    ):
+        dp.add_handler(CommandHandler(name, fn, run_async=True))
+    dp.add_handler(CallbackQueryHandler(on_list_page, pattern=r"^lv:", run_async=True))
+    dp.add_error_handler(lambda update, ctx: print("telegram handler error:", ctx.error))
+
+    # start_polling не блокирует; idle() здесь нельзя — он ставит обработчики сигналов, а это не главный поток
     updater.start_polling()
-    updater.idle()
+    boot_mark("telegram")
+    try:
+        while True:
+            beat("telegram")
+            if not (updater.running and updater.dispatcher.running): raise RuntimeError("updater stopped")
+            time.sleep(5)
+    finally:
+        updater.stop()   # перед перезапуском: два getUpdates на один токен конфликтуют
+
+# ---------- Notion poll loop (adaptive)
+POLL_MIN_SEC = float(env("POLL_MIN_SEC", "2"))
+POLL_MAX_SEC = float(env("POLL_MAX_SEC", "60"))
+POLL_FULL_SEC = float(env("POLL_FULL_SEC", "600"))
+POLL_WEBHOOK_TOKEN = env("POLL_WEBHOOK_TOKEN", None)
+_poll_wake = Event()
+_poll_marker = None
+
+def commands_changed():
+    # дешёвая проба: одна последняя изменённая страница без свойств
+    global _poll_marker
+    if not (notion and NOTION_COMMANDS_DB): return False
+    resp = notion.databases.query(
+        database_id=NOTION_COMMANDS_DB,
+        sorts=[{"timestamp":"last_edited_time","direction":"descending"}],
+        filter_properties=["title"], page_size=1
+    )
+    top = (resp.get("results") or [None])[0]
+    marker = (top["id"], top["last_edited_time"]) if top else None
+    changed, _poll_marker = marker != _poll_marker, marker
+    # last_edited_time округлён до минуты: правки в ту же минуту маркер не меняют, поэтому свежую активность считаем изменением
+    if top and not changed:
+        edited = datetime.fromisoformat(top["last_edited_time"].replace("Z", "+00:00"))
+        changed = datetime.now(pytz.utc) - edited < timedelta(minutes=2)
+    return changed
 
-# ---------- Notion poll loop
 def run_notion_loop():
+    interval, last_full = POLL_MIN_SEC, 0.0
     while True:
-        try: poll_notion_commands()
-        except Exception as e: print("notion loop error:", e)
-        time.sleep(15)
-
-# ---------- Flask keep-alive
-app = Flask(__name__)
-
-@app.route("/")
-def home(): return "I'm alive"
-
-@app.route("/trigger_text")
-def trigger_text():
-    safe_send("Это тестовое сообщение от Коннора. Бот активен и рядом.")
-    return "Ок"
+        beat("notion-poll")
+        ran = 0
+        try:
+            woken = _poll_wake.is_set(); _poll_wake.clear()
+            # полный запрос не реже POLL_FULL_SEC — чтобы подобрать протухшие «In progress»
+            if woken or time.time() - last_full >= POLL_FULL_SEC or commands_changed():
+                last_full = time.time()
+                ran = poll_notion_commands()
+        except Exception as e: report_error("notion loop", e)
+        interval = POLL_MIN_SEC if ran else min(interval * 2, POLL_MAX_SEC)
+        _poll_wake.wait(timeout=interval)
+
+def wake_notion_poll(): _poll_wake.set()
+
+# ---------- HTTP server (один на все эндпоинты)
+def _subscriber_counts():
+    with _subs_lock: subs = list(SUBSCRIBERS.values())
+    return {"active": sum(1 for x in subs if x["active"] and not x["paused"]),
+            "paused": sum(1 for x in subs if x["active"] and x["paused"]), "inactive": sum(1 for x in subs if not x["active"])}
+
+def _gauges():
+    with _outbox_lock:
+        outbox = dict(_outbox().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+    with _cmd_lock: inflight = len(_cmd_inflight)
+    with SCHED_COND: heap = len(SCHED_HEAP)
+    ns = notion.stats_snapshot() if notion else {}
+    return [
+        ("connor_outbox_messages", "Outbox rows by status.", [((("status", k),), v) for k, v in sorted(outbox.items())]),
+        ("connor_notion_log_queue", "Pending Notion log entries.", [((), LOG_QUEUE.qsize())]),
+        ("connor_commands_inflight", "Notion commands queued or running.", [((), inflight)]),
+        ("connor_scheduler_heap", "Planned fires in the scheduler heap.", [((), heap)]),
+        ("connor_schedule_age_seconds", "Seconds since the last schedule sync.",
+         [((), round(time.time() - SCHEDULE_CACHE_TS, 1) if SCHEDULE_CACHE_TS else -1)]),
+        ("connor_worker_beat_age_seconds", "Seconds since each loop last checked in.",
+         [((("worker", k),), round(time.time() - v, 1)) for k, v in sorted(HEARTBEATS.items())]),
+        ("connor_boot_seconds", "Startup phases, seconds from process start.", [((("phase", k),), v) for k, v in BOOT.items()]),
+        ("connor_leader", "1 if this instance runs the scheduler.", [((), int(is_leader()))]),
+        ("connor_subscribers", "Subscribers by state.", [((("state", k),), v) for k, v in sorted(_subscriber_counts().items())]),
+        ("connor_paused", "1 if the owner's scheduled messages are paused.", [((), int(PAUSED))]),
+        ("connor_notion_requests_total", "Notion API calls by endpoint.", [((("endpoint", k),), v["calls"]) for k, v in sorted(ns.items())]),
+        ("connor_notion_errors_total", "Failed Notion API calls by endpoint.", [((("endpoint", k),), v["errors"]) for k, v in sorted(ns.items())]),
+        ("connor_notion_retries_total", "Retried Notion API calls by endpoint.", [((("endpoint", k),), v["retries"]) for k, v in sorted(ns.items())]),
+        ("connor_notion_request_seconds_total", "Time spent in Notion API calls by endpoint.",
+         [((("endpoint", k),), round(v["total_ms"] / 1000, 3)) for k, v in sorted(ns.items())]),
+    ]
+
+def create_app():
+    from flask import Flask, jsonify, request   # импорт — при запуске сервера, а не модуля
+    app = Flask(__name__)
+
+    @app.route("/")
+    def home(): return "I'm alive"
+
+    @app.route("/healthz")
+    def healthz():
+        # живость процесса: главный поток (супервизор) ещё крутится
+        age = time.time() - HEARTBEATS.get("supervisor", time.time())
+        ok = age <= 3 * SUPERVISE_SEC + 5
+        return jsonify({"ok": ok, "supervisor_beat_age_sec": round(age, 1)}), 200 if ok else 503
+
+    @app.route("/readyz")
+    def readyz():
+        r = readiness()
+        return jsonify(r), 200 if r["ready"] else 503
+
+    @app.route("/stats/notion")
+    def notion_stats(): return jsonify(notion.stats_snapshot() if notion else {})
+
+    @app.route("/metrics")
+    def metrics():
+        return render_metrics(_gauges()), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+    @app.route("/hooks/poll", methods=["GET", "POST"])
+    def hook_poll():
+        # пинг из автоматизации Notion -> немедленный опрос команд
+        if not POLL_WEBHOOK_TOKEN: return "disabled", 404
+        token = request.headers.get("X-Webhook-Token") or request.args.get("token", "")
+        if not hmac.compare_digest(token.encode(), POLL_WEBHOOK_TOKEN.encode()): return "forbidden", 403
+        wake_notion_poll()
+        return "ok"
+
+    @app.route("/trigger_text")
+    def trigger_text():
+        safe_send("Это тестовое сообщение от Коннора. Бот активен и рядом.")
+        return "Ок"
+
+    return app
 
 def run_flask():
+    app = create_app()
+    boot_mark("http")
     app.run(host="0.0.0.0", port=int(os.getenv("PORT","8080")))
 
 def keep_alive():
-    Thread(target=run_flask, daemon=True).start()
+    start_worker("flask", run_flask)
 
 # ---------- main loop
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # чтобы atexit успел сбросить лог
+    boot_mark("imports")
+    Thread(target=validate_startup, name="validate", daemon=True).start()
+    if load_snapshot(): boot_mark("snapshot")
+    atexit.register(save_snapshot)
+    load_subscribers()
+    start_sender()   # дослать то, что осталось в outbox с прошлого запуска
     keep_alive()
-    Thread(target=run_telegram_bot, daemon=True).start()
-    Thread(target=run_notion_loop, daemon=True).start()
+    # имя, цикл, сколько секунд без beat() считать зависанием
+    start_worker("telegram", run_telegram_bot, 60, exclusive=True)
+    start_worker("notion-poll", run_notion_loop, POLL_MAX_SEC + 600)
+    start_worker("schedule-sync", run_schedule_sync_loop, 600)
+    start_worker("leader", run_leader_loop, LEASE_TTL_SEC * 4)
+    start_worker("snapshot", run_snapshot_loop, SNAPSHOT_EVERY_SEC + 300)
+    start_worker("index-sync", run_index_sync_loop, INDEX_REFRESH_SEC + 1800)
+    start_worker("scheduler", run_scheduler, 300)
+    start_worker("probe", run_probe_loop, PROBE_TTL_SEC + 120)
 
     print("Бот Коннор запущен. Ждёт своего часа...")
-
-    while True:
-        now = datetime.now(seoul_tz)
-        current_hour = now.hour
-        current_minute = now.minute
-
-        reload_schedule(force=False)
-
-        if current_minute != last_minute:
-            last_minute = current_minute
-            if current_hour == 8 and current_minute == 0:   send_morning()
-            elif current_hour == 22 and current_minute == 0: send_evening()
-            elif current_hour == 8 and current_minute == 30: send_weather()
-            elif current_hour % 2 == 0 and current_minute == 15: send_day_message()
-            run_scheduled_from_notion(now)
-
-        time.sleep(20)
-
-
+    supervise()
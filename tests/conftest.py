@@ -0,0 +1,12 @@
+import os, sys, tempfile
+
+# main.py читает окружение при импорте: задаём его до первого import main
+_tmp = tempfile.mkdtemp(prefix="connor-test-")
+os.environ.update({
+    "API_TOKEN": "123:test", "CHAT_ID": "1", "NOTION_TOKEN": "test",
+    "OUTBOX_PATH": os.path.join(_tmp, "outbox.sqlite3"), "LEDGER_PATH": os.path.join(_tmp, "ledger.sqlite3"),
+    "SNAPSHOT_PATH": os.path.join(_tmp, "state_snapshot.json"), "LOG_SPILL_PATH": os.path.join(_tmp, "spill.jsonl"),
+    "SUBSCRIBERS_PATH": os.path.join(_tmp, "subscribers.sqlite3"),
+    "NOTION_RPS": "1000", "NOTION_BURST": "1000",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,19 @@
+from types import SimpleNamespace
+import main
+
+def page(pid, edited):
+    return {"id": pid, "last_edited_time": edited, "properties": {"Command": {"select": {"name": "send"}},
+            "Text": {"rich_text": [{"type": "text", "text": {"content": "привет"}}]}}}
+
+def test_failed_status_write_does_not_rerun_command(monkeypatch):
+    updates, sent = [], []
+    def update(page_id, properties):
+        updates.append(properties["Status"]["select"]["name"])
+        if properties["Status"]["select"]["name"] == "Done" and len(updates) == 2: raise RuntimeError("notion down")
+    monkeypatch.setattr(main, "notion", SimpleNamespace(pages=SimpleNamespace(update=update)))
+    monkeypatch.setattr(main, "safe_send", lambda text, *a, **k: sent.append(text))
+    main._run_claimed(page("cmd-1", "2026-03-01T10:00:00.000Z"))
+    # «In progress» протух: страница снова пришла из опроса, уже с новым last_edited_time
+    main._run_claimed(page("cmd-1", "2026-03-01T10:11:00.000Z"))
+    assert sent == ["привет"]
+    assert updates == ["In progress", "Done", "In progress", "Done"]
@@ -0,0 +1,45 @@
+import threading, uuid
+from types import SimpleNamespace
+import main
+
+N = 8
+
+def run_together(fn, n=N):
+    # handlers идут через run_async — здесь так же: n потоков, старт одновременно
+    go, errors = threading.Barrier(n), []
+    def worker(i):
+        go.wait()
+        try: fn(i)
+        except Exception as e: errors.append(e)
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads: t.start()
+    for t in threads: t.join(10)
+    assert not errors
+
+def test_parallel_habit_marks_are_all_counted(monkeypatch):
+    created = threading.Barrier(N)   # все create_page в полёте одновременно, _habit_apply сталкиваются
+    def create(parent, properties, **kw):
+        created.wait(5)
+        title = [dict(t, type="text") for t in properties["Habit"]["title"]]   # как отвечает Notion
+        return {"id": uuid.uuid4().hex, "parent": parent, "properties": dict(properties, Habit={"title": title})}
+    monkeypatch.setattr(main, "notion", SimpleNamespace(pages=SimpleNamespace(create=create)))
+    monkeypatch.setattr(main, "NOTION_HABITS_DB", "habits")
+    monkeypatch.setattr(main, "HABITS", {"names": {}, "days": {}, "pages": {}, "synced_at": "x", "full_ts": 0})
+    run_together(lambda i: main.habit_mark("Бег", dt=f"2026-03-{i + 1:02d}"))
+    key = main._norm("Бег")
+    assert len(main.HABITS["pages"]) == N
+    assert sorted(main.HABITS["days"][key]) == [main.date(2026, 3, i + 1).toordinal() for i in range(N)]
+
+def test_parallel_page_callbacks_share_one_cursor(monkeypatch):
+    calls = []
+    def query(database_id, start_cursor=None, **kw):
+        calls.append(start_cursor)
+        n = int(start_cursor or 0)
+        return {"results": [{"properties": {"Title": {"title": [{"type": "text", "text": {"content": f"t{n}"}}]}}}], "has_more": True, "next_cursor": str(n + 1)}
+    monkeypatch.setattr(main, "notion", SimpleNamespace(databases=SimpleNamespace(query=query)))
+    monkeypatch.setitem(main.LIST_KINDS, "inspo", dict(main.LIST_KINDS["inspo"], db="inspo"))
+    first = main.list_page("inspo")
+    pages = []
+    run_together(lambda i: pages.append(main.list_page("inspo", view_id=first["view"], page=1)))
+    assert all(p["page"] == 1 and "t1" in p["text"] for p in pages)
+    assert main.LIST_VIEWS[first["view"]]["cursors"] == [None, "1", "2"]
@@ -0,0 +1,8 @@
+import main
+
+def test_poll_hook_rejects_non_ascii_token(monkeypatch):
+    monkeypatch.setattr(main, "POLL_WEBHOOK_TOKEN", "secret")
+    monkeypatch.setattr(main, "wake_notion_poll", lambda: None)
+    client = main.create_app().test_client()
+    assert client.post("/hooks/poll", query_string={"token": "пароль"}).status_code == 403
+    assert client.post("/hooks/poll", headers={"X-Webhook-Token": "secret"}).status_code == 200
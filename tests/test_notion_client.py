@@ -0,0 +1,31 @@
+import httpx, pytest
+from notion_client.errors import HTTPResponseError
+import main
+
+PAGE = "0f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0"
+
+def client(handler):
+    nc = main.NotionClient(auth="test")
+    nc.client = httpx.Client(transport=httpx.MockTransport(handler))
+    return nc
+
+def test_append_is_not_resent_on_502(monkeypatch):
+    calls = []
+    def handler(req):
+        calls.append((req.method, req.url.path))
+        return httpx.Response(502, json={"object": "error", "status": 502, "code": "bad_gateway", "message": "bad gateway"})
+    nc = client(handler)
+    monkeypatch.setattr(main, "notion", nc)
+    with pytest.raises(HTTPResponseError):
+        main.append_blocks(PAGE, main.text_blocks("hello"))
+    assert calls == [("PATCH", f"/v1/blocks/{PAGE}/children")]
+
+def test_page_update_is_retried_on_502(monkeypatch):
+    monkeypatch.setattr(main.time, "sleep", lambda s: None)
+    calls = []
+    def handler(req):
+        calls.append(req.method)
+        if len(calls) == 1: return httpx.Response(502, json={"object": "error", "status": 502, "code": "bad_gateway", "message": "x"})
+        return httpx.Response(200, json={"object": "page", "id": PAGE})
+    assert client(handler).pages.update(page_id=PAGE, properties={})["id"] == PAGE
+    assert calls == ["PATCH", "PATCH"]
@@ -0,0 +1,41 @@
+import pytest
+import main
+
+OWNER = main.CHAT_ID
+
+@pytest.fixture
+def registry(monkeypatch):
+    with main._subs_lock: main._subs().execute("DELETE FROM subscribers")
+    main.load_subscribers()
+    yield
+    main.PAUSED = False
+
+def restart():
+    main.SUBSCRIBERS.clear(); main.load_subscribers()
+    return main.rebuild_buckets()
+
+def test_owner_stop_start_restart_keeps_owner_subscribed(registry):
+    assert "не отписывается" in main.unsubscribe(OWNER)
+    main.set_subscriber(OWNER, active=False)   # строка из старой версии, где /stop владельца проходил
+    main.subscribe(OWNER)
+    assert main.SUBSCRIBERS[OWNER]["active"]
+    main.set_subscriber(OWNER, active=False)
+    buckets = restart()
+    assert main.SUBSCRIBERS[OWNER]["active"]
+    assert OWNER in buckets["morning"]["chats"]
+
+def test_owner_pause_does_not_silence_subscribers(registry, monkeypatch):
+    monkeypatch.setattr(main, "OPEN_SUBSCRIPTIONS", True)
+    main.subscribe(42)
+    monkeypatch.setattr(main, "BUCKETS", main.rebuild_buckets())
+    sent = []
+    monkeypatch.setattr(main, "enqueue_many", lambda items: sent.extend(c for _, _, c in items) or len(items))
+    main.PAUSED = True
+    main.fan_out("morning", "2026-03-01T08:00")
+    assert sent == [42]
+
+def test_no_weather_broadcast_without_key(registry, monkeypatch):
+    monkeypatch.setattr(main, "WEATHER_API_KEY", None)
+    assert not any(b["job"] == "weather" for b in main.rebuild_buckets().values())
+    monkeypatch.setattr(main, "WEATHER_API_KEY", "k")
+    assert "weather" in main.rebuild_buckets()
@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+import pytest
+import main
+
+def test_append_without_name_touches_nothing(monkeypatch):
+    monkeypatch.setattr(main, "NOTION_WEBSITE_DB", "site")
+    monkeypatch.setattr(main, "notion", SimpleNamespace())   # любое обращение к Notion упадёт
+    assert main.website_append("", content="текст") == "no page name"
+    assert main.website_append("  ", content="текст") == "no page name"
+
+def test_failed_append_archives_the_partial_page(monkeypatch):
+    calls = []
+    def append(block_id, children): raise RuntimeError("502")
+    def update(page_id, archived=False, **kw): calls.append((page_id, archived))
+    monkeypatch.setattr(main, "NOTION_WEBSITE_DB", "site")
+    monkeypatch.setattr(main, "notion", SimpleNamespace(
+        pages=SimpleNamespace(create=lambda **kw: {"id": "p1", "parent": kw["parent"]}, update=update),
+        blocks=SimpleNamespace(children=SimpleNamespace(append=append))))
+    text = "\n\n".join(f"абзац {i}" for i in range(main.NOTION_BLOCKS_MAX + 5))
+    with pytest.raises(RuntimeError):
+        main.website_add_page("Длинный пост", content=text)
+    assert calls == [("p1", True)]